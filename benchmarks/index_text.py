@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""Compare counting tokens one at a time with the batched Counter merge used
+by :meth:`levatas_indexer.indexer.WordIndexer.index_text`.
+
+The token streams follow a Zipf distribution over the vocabulary, which is
+roughly how words are distributed in real pages.
+"""
+from argparse import ArgumentParser
+from collections import defaultdict
+import pathlib
+import random
+import sys
+import timeit
+
+PATH = pathlib.Path(__file__).parent.parent.resolve()
+sys.path.insert(0, str(PATH))
+
+from levatas_indexer import indexer
+
+
+class PreTokenized:
+    """Tokenizer stand-in that hands back tokens that were already split, so
+    only the cost of counting is measured
+    """
+    def __init__(self, tokens):
+        self.tokens = tokens
+
+    def iter_tokens(self, text):
+        return iter(self.tokens)
+
+
+def make_tokens(count, vocabulary):
+    words = [f'word{i}' for i in range(vocabulary)]
+    weights = [1 / rank for rank in range(1, vocabulary + 1)]
+
+    return random.choices(words, weights=weights, k=count)
+
+
+def count_per_token(tokens):
+    words = defaultdict(int)
+
+    for word in tokens:
+        words[word] += 1
+
+    return words
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--vocabulary', type=int, default=20000,
+                        help='The number of distinct words')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='How many times to time each method')
+    args = parser.parse_args()
+
+    random.seed(0)
+
+    for count in (1000, 10000, 100000, 1000000):
+        tokens = make_tokens(count, args.vocabulary)
+        word_indexer = indexer.WordIndexer(PreTokenized(tokens))
+
+        per_token = min(timeit.repeat(lambda: count_per_token(tokens),
+                                      number=1, repeat=args.repeat))
+        batched = min(timeit.repeat(lambda: word_indexer.index_text(''),
+                                    number=1, repeat=args.repeat))
+
+        print(f'{count:>8} tokens: per token {per_token * 1000:8.2f}ms  '
+              f'batched {batched * 1000:8.2f}ms  speedup {per_token / batched:5.2f}x')
+
+
+if __name__ == '__main__':
+
+    main()
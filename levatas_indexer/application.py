@@ -18,6 +18,8 @@ logging.config.dictConfig(logging_config)
 
 env = os.environ.get('APP_ENVIRONMENT', 'production')
 app = Flask(__name__)
+# The /queue routes of distributed crawls are only served with a token
+app.config['QUEUE_TOKEN'] = os.environ.get('QUEUE_TOKEN')
 
 if env == 'dev':
     app.config['TEMPLATES_AUTO_RELOAD'] = True
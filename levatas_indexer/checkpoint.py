@@ -0,0 +1,304 @@
+"""Persistent crawl checkpoints
+
+This module saves the progress of a crawl to a SQLite database so that a
+crawl that dies part way through can be resumed by its job id. A checkpoint
+holds the frontier of urls waiting to be fetched, the set of urls already
+queued, the word and phrase counts of the pages indexed so far and the
+fingerprints used for duplicate detection.
+
+Saves are incremental. Each one adds the urls, counts and fingerprints
+gathered since the previous save and replaces the frontier, in a single
+transaction, so a checkpoint is always a consistent picture of the crawl
+and the cost of a save doesn't grow with the size of the crawl.
+
+Since saves add to the progress already saved, only one run may crawl a job
+at a time. A run holds the job by writing its owner id to the job, and
+keeps the hold alive with a heartbeat written by every save. A job can be
+taken over once its owner releases it or stops saving for LOCK_TIMEOUT
+seconds.
+"""
+from contextlib import closing
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+import json
+import sqlite3
+import time
+import uuid
+
+from .paths import CHECKPOINT_PATH
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    complete INTEGER NOT NULL DEFAULT 0,
+    skipped INTEGER NOT NULL DEFAULT 0,
+    updated REAL NOT NULL,
+    owner TEXT,
+    heartbeat REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS frontier (
+    job_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    url TEXT NOT NULL,
+    depth INTEGER NOT NULL,
+    PRIMARY KEY (job_id, position)
+);
+CREATE TABLE IF NOT EXISTS visited (
+    job_id TEXT NOT NULL,
+    url TEXT NOT NULL,
+    PRIMARY KEY (job_id, url)
+);
+CREATE TABLE IF NOT EXISTS counts (
+    job_id TEXT NOT NULL,
+    word TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (job_id, word)
+);
+CREATE TABLE IF NOT EXISTS phrases (
+    job_id TEXT NOT NULL,
+    phrase TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (job_id, phrase)
+);
+CREATE TABLE IF NOT EXISTS fingerprints (
+    job_id TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    simhash TEXT NOT NULL
+);
+'''
+JOB_TABLES = ('frontier', 'visited', 'counts', 'phrases', 'fingerprints', 'jobs')
+LOCK_TIMEOUT = 300.0
+
+
+class JobLockedError(RuntimeError):
+    """Raised when a job is already being crawled by another run"""
+
+
+class CheckpointState(NamedTuple):
+    """A snapshot of a crawl loaded from a checkpoint
+
+    :param url: The root url of the crawl
+    :type url: str
+    :param complete: Whether or not the crawl finished
+    :type complete: bool
+    :param pending: The urls waiting to be fetched and their depths
+    :type pending: List[Tuple[str, int]]
+    :param visited: The urls that have already been queued
+    :type visited: Set[str]
+    :param counts: The word counts of the pages indexed so far
+    :type counts: Dict[str, int]
+    :param phrases: The phrase counts of the pages indexed so far
+    :type phrases: Dict[Tuple[str, ...], int]
+    :param fingerprints: The content hashes and SimHashes of the pages
+        indexed so far
+    :type fingerprints: List[Tuple[str, int]]
+    :param skipped: The number of duplicate pages skipped so far
+    :type skipped: int
+    """
+    url: str
+    complete: bool
+    pending: List[Tuple[str, int]]
+    visited: Set[str]
+    counts: Dict[str, int]
+    phrases: Dict[Tuple[str, ...], int]
+    fingerprints: List[Tuple[str, int]]
+    skipped: int
+
+
+class Checkpoint:
+    """Save and load the progress of a single crawl job
+
+    :param job_id: The id of the crawl job
+    :type job_id: str
+    :param path: The path of the SQLite database
+    :type path: str
+    :param owner: A unique id for the run using the checkpoint
+    :type owner: str
+    """
+    def __init__(self, job_id: str, path: str = CHECKPOINT_PATH):
+        """Constructor method
+
+        :param job_id: The id of the crawl job
+        :type job_id: str
+        :param path: The path of the SQLite database
+        :type path: str, optional
+        """
+        self.job_id = job_id
+        self.path = path
+        self.owner = uuid.uuid4().hex
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open a connection to the database, creating the tables if needed
+
+        :return: A connection to the database
+        :rtype: :class:`sqlite3.Connection`
+        """
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.executescript(SCHEMA)
+
+        return connection
+
+    def exists(self) -> bool:
+        """Check if the job has been checkpointed
+
+        :return: Whether or not a checkpoint exists
+        :rtype: bool
+        """
+        with closing(self._connect()) as connection:
+            row = connection.execute('SELECT 1 FROM jobs WHERE job_id = ?',
+                                     (self.job_id,)).fetchone()
+
+        return row is not None
+
+    def acquire(self, url: str) -> bool:
+        """Hold the job so that no other run can crawl it
+
+        :param url: The root url of the crawl, saved if the job is new
+        :type url: str
+        :return: Whether or not the job is now held by this checkpoint.
+            False if another run holds it.
+        :rtype: bool
+        """
+        now = time.time()
+
+        with closing(self._connect()) as connection:
+            with connection:
+                cursor = connection.execute(
+                    'INSERT INTO jobs (job_id, url, updated, owner, heartbeat) '
+                    'VALUES (?, ?, ?, ?, ?) ON CONFLICT (job_id) DO UPDATE SET '
+                    'owner = excluded.owner, heartbeat = excluded.heartbeat '
+                    'WHERE owner IS NULL OR owner = excluded.owner OR heartbeat < ?',
+                    (self.job_id, url, now, self.owner, now, now - LOCK_TIMEOUT)
+                )
+
+        return cursor.rowcount == 1
+
+    def release(self) -> None:
+        """Let other runs crawl the job again"""
+        with closing(self._connect()) as connection:
+            with connection:
+                connection.execute('UPDATE jobs SET owner = NULL WHERE job_id = ? AND owner = ?',
+                                   (self.job_id, self.owner))
+
+    # Each argument is a separate part of the progress, mirroring CheckpointState
+    def save(self,  # pylint: disable=too-many-arguments
+             url: str,
+             pending: List[Tuple[str, int]],
+             visited: Iterable[str],
+             counts: Dict[str, int],
+             *,
+             phrases: Optional[Dict[Tuple[str, ...], int]] = None,
+             fingerprints: Optional[List[Tuple[str, int]]] = None,
+             skipped: int = 0,
+             complete: bool = False) -> None:
+        """Add the progress made since the previous save to the checkpoint
+
+        The frontier is replaced, while the visited urls, counts and
+        fingerprints are added to the ones already saved. Saving renews the
+        hold on the job if this checkpoint holds it.
+
+        :param url: The root url of the crawl
+        :type url: str
+        :param pending: The urls waiting to be fetched and their depths
+        :type pending: List[Tuple[str, int]]
+        :param visited: The urls queued since the previous save
+        :type visited: Iterable[str]
+        :param counts: The word counts of the pages indexed since the previous
+            save
+        :type counts: Dict[str, int]
+        :param phrases: The phrase counts of the pages indexed since the
+            previous save
+        :type phrases: Dict[Tuple[str, ...], int], optional
+        :param fingerprints: The content hashes and SimHashes of the pages
+            indexed since the previous save
+        :type fingerprints: List[Tuple[str, int]], optional
+        :param skipped: The total number of duplicate pages skipped so far
+        :type skipped: int, optional
+        :param complete: Whether or not the crawl finished
+        :type complete: bool, optional
+        """
+        now = time.time()
+
+        with closing(self._connect()) as connection:
+            with connection:
+                connection.execute(
+                    'INSERT INTO jobs (job_id, url, complete, skipped, updated) '
+                    'VALUES (?, ?, ?, ?, ?) ON CONFLICT (job_id) DO UPDATE SET '
+                    'url = excluded.url, complete = excluded.complete, '
+                    'skipped = excluded.skipped, updated = excluded.updated, '
+                    'heartbeat = CASE owner WHEN ? THEN excluded.updated ELSE heartbeat END',
+                    (self.job_id, url, int(complete), skipped, now, self.owner)
+                )
+                connection.execute('DELETE FROM frontier WHERE job_id = ?', (self.job_id,))
+                connection.executemany(
+                    'INSERT INTO frontier (job_id, position, url, depth) VALUES (?, ?, ?, ?)',
+                    ((self.job_id, position, pending_url, depth)
+                     for position, (pending_url, depth) in enumerate(pending))
+                )
+                connection.executemany(
+                    'INSERT OR IGNORE INTO visited (job_id, url) VALUES (?, ?)',
+                    ((self.job_id, visited_url) for visited_url in visited)
+                )
+                connection.executemany(
+                    'INSERT INTO counts (job_id, word, count) VALUES (?, ?, ?) '
+                    'ON CONFLICT (job_id, word) DO UPDATE SET count = count + excluded.count',
+                    ((self.job_id, word, count) for word, count in counts.items())
+                )
+                connection.executemany(
+                    'INSERT INTO phrases (job_id, phrase, count) VALUES (?, ?, ?) '
+                    'ON CONFLICT (job_id, phrase) DO UPDATE SET count = count + excluded.count',
+                    ((self.job_id, json.dumps(phrase), count)
+                     for phrase, count in (phrases or {}).items())
+                )
+                connection.executemany(
+                    'INSERT INTO fingerprints (job_id, digest, simhash) VALUES (?, ?, ?)',
+                    ((self.job_id, digest, format(simhash, 'x'))
+                     for digest, simhash in fingerprints or [])
+                )
+
+    def load(self) -> Optional[CheckpointState]:
+        """Load the checkpoint of the job
+
+        :return: The saved state of the crawl, or None if the job has not
+            been checkpointed
+        :rtype: :class:`levatas_indexer.checkpoint.CheckpointState`, optional
+        """
+        with closing(self._connect()) as connection:
+            job = connection.execute('SELECT url, complete, skipped FROM jobs WHERE job_id = ?',
+                                     (self.job_id,)).fetchone()
+
+            if job is None:
+                return None
+
+            pending = connection.execute(
+                'SELECT url, depth FROM frontier WHERE job_id = ? ORDER BY position',
+                (self.job_id,)
+            ).fetchall()
+            visited = connection.execute('SELECT url FROM visited WHERE job_id = ?',
+                                         (self.job_id,)).fetchall()
+            counts = connection.execute('SELECT word, count FROM counts WHERE job_id = ?',
+                                        (self.job_id,)).fetchall()
+            phrases = connection.execute('SELECT phrase, count FROM phrases WHERE job_id = ?',
+                                         (self.job_id,)).fetchall()
+            fingerprints = connection.execute(
+                'SELECT digest, simhash FROM fingerprints WHERE job_id = ?',
+                (self.job_id,)
+            ).fetchall()
+
+        return CheckpointState(
+            url=job[0],
+            complete=bool(job[1]),
+            pending=pending,
+            visited={url for (url,) in visited},
+            counts=dict(counts),
+            phrases={tuple(json.loads(phrase)): count for phrase, count in phrases},
+            fingerprints=[(digest, int(simhash, 16)) for digest, simhash in fingerprints],
+            skipped=job[2]
+        )
+
+    def delete(self) -> None:
+        """Remove the checkpoint of the job"""
+        with closing(self._connect()) as connection:
+            with connection:
+                for table in JOB_TABLES:
+                    connection.execute(f'DELETE FROM {table} WHERE job_id = ?', (self.job_id,))
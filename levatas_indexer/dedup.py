@@ -0,0 +1,227 @@
+"""Near-duplicate document detection
+
+This module provides a filter for skipping documents whose content has
+already been indexed. Every document is fingerprinted with an exact content
+hash and a 64 bit SimHash over word shingles. A document is considered a
+duplicate if its content hash has been seen before, or if its SimHash is
+within a configurable Hamming distance of a document that was already
+accepted.
+
+Fingerprints are computed from a cheap normalization of the raw document so
+that duplicates can be rejected before the more expensive tokenization and
+stemming is done. Like the index, the normalization leaves out the content
+of scripts, styles and comments, so pages sharing a large inline script are
+still told apart by their text.
+"""
+from collections import Counter, defaultdict
+from typing import Dict, List, Set, Tuple
+import hashlib
+import re
+
+FINGERPRINT_BITS = 64
+TAG_PATTERN = re.compile(r'<[^>]*>')
+HIDDEN_PATTERN = re.compile(r'<!--.*?-->|<(script|style|noscript|template)\b[^>]*>.*?</\1\s*>',
+                            re.IGNORECASE | re.DOTALL)
+WORD_PATTERN = re.compile(r'\w+')
+
+
+def normalize_words(text: str) -> List[str]:
+    """Extract the lower cased words from a document, ignoring markup and
+    the content of scripts, styles and comments
+
+    :param text: The document to normalize
+    :type text: str
+    :return: The words in the document
+    :rtype: List[str]
+    """
+    text = HIDDEN_PATTERN.sub(' ', text)
+
+    return WORD_PATTERN.findall(TAG_PATTERN.sub(' ', text).lower())
+
+
+def content_hash(words: List[str]) -> str:
+    """Hash the normalized words of a document
+
+    :param words: The normalized words of a document
+    :type words: List[str]
+    :return: A hex digest of the words
+    :rtype: str
+    """
+    return hashlib.blake2b(' '.join(words).encode('utf-8')).hexdigest()
+
+
+def simhash(words: List[str], shingle_size: int = 3) -> int:
+    """Compute a 64 bit SimHash over the word shingles of a document
+
+    Rather than looping over all 64 bits for every shingle, the shingle
+    hashes are tallied one byte position at a time and the per bit totals
+    are derived from the byte tallies.
+
+    :param words: The normalized words of a document
+    :type words: List[str]
+    :param shingle_size: The number of words in a shingle
+    :type shingle_size: int, optional
+    :return: The fingerprint of the document
+    :rtype: int
+    """
+    shingle_count = max(len(words) - shingle_size + 1, 1)
+    digests = [
+        hashlib.blake2b(
+            ' '.join(words[i:i + shingle_size]).encode('utf-8'),
+            digest_size=FINGERPRINT_BITS // 8
+        ).digest()
+        for i in range(shingle_count)
+    ]
+
+    fingerprint = 0
+
+    for position in range(FINGERPRINT_BITS // 8):
+        tally = Counter(digest[position] for digest in digests)
+
+        for bit in range(8):
+            ones = sum(count for value, count in tally.items() if value >> bit & 1)
+
+            if ones * 2 > len(digests):
+                fingerprint |= 1 << (position * 8 + bit)
+
+    return fingerprint
+
+
+def hamming_distance(first: int, second: int) -> int:
+    """Count the number of bits that differ between two fingerprints
+
+    :param first: A fingerprint
+    :type first: int
+    :param second: Another fingerprint
+    :type second: int
+    :return: The number of differing bits
+    :rtype: int
+    """
+    return (first ^ second).bit_count()
+
+
+class DuplicateFilter:
+    """Track the fingerprints of indexed documents and reject duplicates
+
+    Near-duplicate lookups use the pigeonhole principle. Fingerprints are
+    split into max_distance + 1 bands, and any two fingerprints within
+    max_distance bits of each other must share at least one band exactly, so
+    only documents sharing a band are compared.
+
+    :param max_distance: The maximum Hamming distance between the SimHashes
+        of two documents for them to be considered duplicates
+    :type max_distance: int
+    :param shingle_size: The number of words in a shingle
+    :type shingle_size: int
+    :param skipped: The number of documents rejected as duplicates
+    :type skipped: int
+    """
+    def __init__(self, max_distance: int = 3, shingle_size: int = 3):
+        """Constructor method
+
+        :param max_distance: The maximum Hamming distance between the
+            SimHashes of two documents for them to be considered duplicates
+        :type max_distance: int, optional
+        :param shingle_size: The number of words in a shingle
+        :type shingle_size: int, optional
+        """
+        if not 0 <= max_distance < FINGERPRINT_BITS:
+            raise ValueError(f'max_distance must be between 0 and {FINGERPRINT_BITS - 1}')
+
+        self.max_distance = max_distance
+        self.shingle_size = shingle_size
+        self.skipped = 0
+        self._hashes: Set[str] = set()
+        self._fingerprints: List[Tuple[str, int]] = []
+        self._bands: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+
+        band_count = max_distance + 1
+        width, extra = divmod(FINGERPRINT_BITS, band_count)
+        self._band_masks = []
+        offset = 0
+
+        for band in range(band_count):
+            band_width = width + (1 if band < extra else 0)
+            self._band_masks.append(((1 << band_width) - 1) << offset)
+            offset += band_width
+
+    @property
+    def fingerprints(self) -> List[Tuple[str, int]]:
+        """Property for accessing a copy of the accepted fingerprints
+
+        Each fingerprint is a tuple of the content hash and the SimHash.
+        """
+        return list(self._fingerprints)
+
+    def fingerprints_since(self, position: int) -> List[Tuple[str, int]]:
+        """Get the fingerprints accepted after the first position of them
+
+        :param position: The number of fingerprints to skip
+        :type position: int
+        :return: A list of tuples of the content hash and the SimHash
+        :rtype: List[Tuple[str, int]]
+        """
+        return self._fingerprints[position:]
+
+    def add(self, digest: str, fingerprint: int) -> None:
+        """Record the fingerprint of an accepted document
+
+        :param digest: The content hash of the document
+        :type digest: str
+        :param fingerprint: The SimHash of the document
+        :type fingerprint: int
+        """
+        self._hashes.add(digest)
+        self._fingerprints.append((digest, fingerprint))
+
+        for band, mask in enumerate(self._band_masks):
+            self._bands[(band, fingerprint & mask)].append(fingerprint)
+
+    def _has_near_duplicate(self, fingerprint: int) -> bool:
+        """Check if an accepted document is within max_distance of the given
+        fingerprint
+
+        :param fingerprint: The SimHash to search for
+        :type fingerprint: int
+        :return: Whether or not a near duplicate exists
+        :rtype: bool
+        """
+        for band, mask in enumerate(self._band_masks):
+            for candidate in self._bands.get((band, fingerprint & mask), []):
+                if hamming_distance(candidate, fingerprint) <= self.max_distance:
+                    return True
+
+        return False
+
+    def is_duplicate(self, text: str) -> bool:
+        """Check a document against the documents already seen
+
+        Documents that are not duplicates are recorded, so the first copy of
+        a document is always accepted and every later copy is rejected.
+        Documents without any words are never considered duplicates.
+
+        :param text: The raw document
+        :type text: str
+        :return: Whether or not the document is a duplicate
+        :rtype: bool
+        """
+        words = normalize_words(text)
+
+        if not words:
+            return False
+
+        digest = content_hash(words)
+
+        if digest in self._hashes:
+            self.skipped += 1
+            return True
+
+        fingerprint = simhash(words, self.shingle_size)
+
+        if self._has_near_duplicate(fingerprint):
+            self.skipped += 1
+            return True
+
+        self.add(digest, fingerprint)
+
+        return False
@@ -0,0 +1,853 @@
+"""Distributed crawling
+
+This module spreads a single crawl across several worker processes or
+machines. Workers share a frontier and visited set through a
+:class:`WorkQueue`, claim urls from it with a lease, fetch and count the
+pages locally, and ship the counts back to the queue where they are merged.
+
+Counts are only accepted from a worker that still holds the lease on the
+url, so every page is counted exactly once even when a worker dies and its
+urls are handed to another worker. Urls found again at a greater depth are
+queued again to have their links followed, without being counted again, so
+the final index matches a single process crawl of the same site.
+
+Every worker paces its own requests to each host and follows robots.txt,
+so a host sees at most the rate of a single crawl from each worker.
+
+Three queues are provided: :class:`MemoryWorkQueue` for workers that are
+threads in one process, :class:`SQLiteWorkQueue` for workers that are
+processes on one machine, and :class:`RemoteWorkQueue` for workers on other
+machines, which talks to the ``/queue`` routes of the web app.
+"""
+from abc import ABC, abstractmethod
+from collections import Counter
+from contextlib import closing, contextmanager
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+import heapq
+import json
+import logging
+import multiprocessing
+import sqlite3
+import threading
+import time
+import uuid
+
+import requests
+
+from . import indexer as indexers
+from . import scheduler, utils
+from .paths import QUEUE_PATH
+
+LEASE_SECONDS = 60.0
+POLL_INTERVAL = 0.5
+BATCH_SIZE = 10
+REQUEST_TIMEOUT = 30
+# The longest a url can take to fetch, counting the fetch of its robots.txt
+MAX_FETCH_SECONDS = utils.FETCH_TIMEOUT + scheduler.ROBOTS_TIMEOUT
+
+Term = Union[str, Tuple[str, ...]]
+
+
+class Task(NamedTuple):
+    """A url claimed from a work queue
+
+    :param url: The url to fetch
+    :type url: str
+    :param depth: How deep to keep fetching documents from the url
+    :type depth: int
+    :param needs_index: Whether or not the page still needs to be counted.
+        Urls that were already counted are only fetched again to follow
+        their links to a greater depth.
+    :type needs_index: bool
+    """
+    url: str
+    depth: int
+    needs_index: bool
+
+
+class WorkerOptions(NamedTuple):
+    """The settings of the workers of a distributed crawl
+
+    :param ngram_size: The largest number of tokens in a phrase to count.
+        Must match the crawl being joined.
+    :type ngram_size: int
+    :param max_size: The maximum size in bytes of a document to index
+    :type max_size: int
+    :param lease: How many seconds a worker has to complete a url
+    :type lease: float
+    :param batch_size: How many pages to count before sending the counts
+    :type batch_size: int
+    :param rate: The starting number of requests per second a worker makes
+        to each host
+    :type rate: float
+    :param respect_robots: Whether or not to skip urls disallowed by
+        robots.txt
+    :type respect_robots: bool
+    :param poll_interval: How long to wait when there is nothing to claim
+    :type poll_interval: float
+    """
+    ngram_size: int = 1
+    max_size: int = utils.MAX_PAGE_SIZE
+    lease: float = LEASE_SECONDS
+    batch_size: int = BATCH_SIZE
+    rate: float = 1.0
+    respect_robots: bool = True
+    poll_interval: float = POLL_INTERVAL
+
+
+def encode_counts(counts: Dict[Term, int]) -> List[list]:
+    """Convert counts into a form that can be serialized as JSON
+
+    :param counts: A dictionary where the keys are words or tuples of the
+        tokens of a phrase
+    :type counts: Dict[Union[str, Tuple[str, ...]], int]
+    :return: A list of pairs of the term and its count, where phrases are
+        lists of tokens
+    :rtype: List[list]
+    """
+    return [[list(term) if isinstance(term, tuple) else term, count]
+            for term, count in counts.items()]
+
+
+def decode_counts(pairs: List[list]) -> Dict[Term, int]:
+    """Convert counts created by :func:`encode_counts` back into a dictionary
+
+    :param pairs: A list of pairs of the term and its count
+    :type pairs: List[list]
+    :return: A dictionary where the keys are words or tuples of the tokens of
+        a phrase
+    :rtype: Dict[Union[str, Tuple[str, ...]], int]
+    """
+    return {tuple(term) if isinstance(term, list) else term: count for term, count in pairs}
+
+
+class WorkQueue(ABC):
+    """A frontier and visited set shared by the workers of a crawl
+
+    Every url goes through three states. It is pending once it is pushed,
+    leased once a worker claims it, and done once the worker completes it.
+    A lease that isn't completed in time expires and the url can be claimed
+    by another worker.
+    """
+    @abstractmethod
+    def push_many(self, items: List[Tuple[str, int]]) -> None:
+        """Add urls to the queue
+
+        Urls that have been seen before are ignored, unless they are pushed
+        with a greater depth, in which case they are queued again so their
+        links are followed to the new depth.
+
+        :param items: Tuples of the url and its depth
+        :type items: List[Tuple[str, int]]
+        """
+
+    def push(self, url: str, depth: int) -> None:
+        """Add a url to the queue
+
+        :param url: The url to fetch
+        :type url: str
+        :param depth: How deep to keep fetching documents from the url
+        :type depth: int
+        """
+        self.push_many([(url, depth)])
+
+    @abstractmethod
+    def claim(self, worker_id: str, lease: float = LEASE_SECONDS) -> Optional[Task]:
+        """Lease the next url to fetch
+
+        Urls with the greatest depth are handed out first, which keeps the
+        crawl close to breadth first order.
+
+        :param worker_id: The id of the worker claiming the url
+        :type worker_id: str
+        :param lease: How many seconds the worker has to complete the url
+        :type lease: float, optional
+        :return: The claimed url, or None if nothing is waiting to be fetched
+        :rtype: :class:`levatas_indexer.distributed.Task`, optional
+        """
+
+    @abstractmethod
+    def complete(self,
+                 worker_id: str,
+                 results: List[Tuple[str, int, Dict[Term, int]]]) -> int:
+        """Finish claimed urls and merge the counts of their pages
+
+        Results for urls the worker no longer holds the lease on are
+        ignored.
+
+        :param worker_id: The id of the worker completing the urls
+        :type worker_id: str
+        :param results: Tuples of the url, the depth it was fetched with and
+            the counts of its page
+        :type results: List[Tuple[str, int, Dict[Union[str, Tuple[str, ...]], int]]]
+        :return: The number of results that were accepted
+        :rtype: int
+        """
+
+    @abstractmethod
+    def finished(self) -> bool:
+        """Check if every url has been completed
+
+        :return: Whether or not the crawl is finished
+        :rtype: bool
+        """
+
+    @abstractmethod
+    def counts(self) -> Dict[Term, int]:
+        """Get the merged counts of every completed page
+
+        :return: A dictionary where the keys are words or tuples of the
+            tokens of a phrase
+        :rtype: Dict[Union[str, Tuple[str, ...]], int]
+        """
+
+
+class _Entry:  # pylint: disable=too-few-public-methods
+    """The state of a single url in a :class:`MemoryWorkQueue`"""
+    __slots__ = ('depth', 'state', 'indexed', 'worker', 'expires', 'sequence')
+
+    def __init__(self, depth: int, sequence: int):
+        self.depth = depth
+        self.state = 'pending'
+        self.indexed = False
+        self.worker: Optional[str] = None
+        self.expires = 0.0
+        self.sequence = sequence
+
+
+class MemoryWorkQueue(WorkQueue):
+    """Work queue for workers running as threads in a single process
+
+    Pending urls are kept in a heap ordered by depth and leases in a heap
+    ordered by expiry, so claiming a url doesn't scan every url seen.
+    Entries in the heaps are checked against the url's current state when
+    they are popped, and skipped if they are out of date.
+    """
+    def __init__(self, clock=time.time):
+        """Constructor method
+
+        :param clock: Function returning the current time in seconds
+        :type clock: Callable[[], float], optional
+        """
+        self._clock = clock
+        self._entries: Dict[str, _Entry] = {}
+        self._pending: List[Tuple[int, int, str]] = []
+        self._leases: List[Tuple[float, int, str]] = []
+        self._unfinished = 0
+        self._counts: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def _queue(self, url: str, entry: _Entry) -> None:
+        """Mark an entry as pending and add it to the pending heap
+
+        :param url: The url of the entry
+        :type url: str
+        :param entry: The entry to queue
+        :type entry: :class:`levatas_indexer.distributed._Entry`
+        """
+        if entry.state == 'done':
+            self._unfinished += 1
+
+        entry.state = 'pending'
+        heapq.heappush(self._pending, (-entry.depth, entry.sequence, url))
+
+    def _next_claimable(self, now: float) -> Optional[Tuple[str, _Entry]]:
+        """Pop the url with an expired lease, or else the pending url with
+        the greatest depth
+
+        :param now: The current time
+        :type now: float
+        :return: The url and its entry, or None if nothing can be claimed
+        :rtype: Tuple[str, :class:`levatas_indexer.distributed._Entry`],
+            optional
+        """
+        while self._leases and self._leases[0][0] < now:
+            expires, _, url = heapq.heappop(self._leases)
+            entry = self._entries[url]
+
+            if entry.state == 'leased' and entry.expires == expires:
+                return url, entry
+
+        while self._pending:
+            depth, _, url = heapq.heappop(self._pending)
+            entry = self._entries[url]
+
+            if entry.state == 'pending' and entry.depth == -depth:
+                return url, entry
+
+        return None
+
+    def push_many(self, items: List[Tuple[str, int]]) -> None:
+        with self._lock:
+            for url, depth in items:
+                entry = self._entries.get(url)
+
+                if entry is None:
+                    entry = self._entries[url] = _Entry(depth, len(self._entries))
+                    self._unfinished += 1
+                    self._queue(url, entry)
+
+                elif depth > entry.depth:
+                    entry.depth = depth
+
+                    if entry.state != 'leased':
+                        self._queue(url, entry)
+
+    def claim(self, worker_id: str, lease: float = LEASE_SECONDS) -> Optional[Task]:
+        with self._lock:
+            now = self._clock()
+            claimable = self._next_claimable(now)
+
+            if claimable is None:
+                return None
+
+            url, entry = claimable
+            entry.state = 'leased'
+            entry.worker = worker_id
+            entry.expires = now + lease
+            heapq.heappush(self._leases, (entry.expires, entry.sequence, url))
+
+            return Task(url, entry.depth, not entry.indexed)
+
+    def complete(self,
+                 worker_id: str,
+                 results: List[Tuple[str, int, Dict[Term, int]]]) -> int:
+        accepted = 0
+
+        with self._lock:
+            for url, depth, counts in results:
+                entry = self._entries.get(url)
+
+                if entry is None or entry.state != 'leased' or entry.worker != worker_id:
+                    continue
+
+                if not entry.indexed:
+                    self._counts.update(counts)
+                    entry.indexed = True
+
+                entry.worker = None
+                accepted += 1
+
+                if entry.depth > depth:
+                    self._queue(url, entry)
+
+                else:
+                    entry.state = 'done'
+                    self._unfinished -= 1
+
+        return accepted
+
+    def finished(self) -> bool:
+        with self._lock:
+            return self._unfinished == 0
+
+    def counts(self) -> Dict[Term, int]:
+        with self._lock:
+            return dict(self._counts)
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS tasks (
+    job_id TEXT NOT NULL,
+    url TEXT NOT NULL,
+    depth INTEGER NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    indexed INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    expires REAL NOT NULL DEFAULT 0,
+    UNIQUE (job_id, url)
+);
+CREATE INDEX IF NOT EXISTS tasks_pending ON tasks (job_id, state, depth DESC);
+CREATE INDEX IF NOT EXISTS tasks_leases ON tasks (job_id, state, expires);
+CREATE TABLE IF NOT EXISTS task_counts (
+    job_id TEXT NOT NULL,
+    term TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (job_id, term)
+);
+'''
+
+
+class SQLiteWorkQueue(WorkQueue):
+    """Work queue for workers running as processes on a single machine
+
+    Each operation runs in its own immediate transaction, so any number of
+    processes can share the database. Urls are claimed through an index of
+    pending urls by depth and an index of leases by expiry, and the rowid
+    keeps urls of the same depth in the order they were pushed.
+
+    :param job_id: The id of the crawl job
+    :type job_id: str
+    :param path: The path of the SQLite database
+    :type path: str
+    """
+    def __init__(self, job_id: str, path: str = QUEUE_PATH, clock=time.time):
+        """Constructor method
+
+        :param job_id: The id of the crawl job
+        :type job_id: str
+        :param path: The path of the SQLite database
+        :type path: str, optional
+        :param clock: Function returning the current time in seconds
+        :type clock: Callable[[], float], optional
+        """
+        self.job_id = job_id
+        self.path = path
+        self._clock = clock
+
+        with closing(sqlite3.connect(self.path, timeout=30)) as connection:
+            connection.executescript(SCHEMA)
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Open a connection to the database in an immediate transaction
+
+        Immediate transactions take the write lock up front, so two
+        processes can't both read the same pending url and claim it.
+
+        :return: A connection to the database
+        :rtype: Iterator[:class:`sqlite3.Connection`]
+        """
+        with closing(sqlite3.connect(self.path, timeout=30, isolation_level=None)) as connection:
+            connection.execute('BEGIN IMMEDIATE')
+
+            try:
+                yield connection
+
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+
+            connection.execute('COMMIT')
+
+    def push_many(self, items: List[Tuple[str, int]]) -> None:
+        with self._transaction() as connection:
+            for url, depth in items:
+                row = connection.execute('SELECT depth FROM tasks WHERE job_id = ? AND url = ?',
+                                         (self.job_id, url)).fetchone()
+
+                if row is None:
+                    connection.execute('INSERT INTO tasks (job_id, url, depth) VALUES (?, ?, ?)',
+                                       (self.job_id, url, depth))
+
+                elif depth > row[0]:
+                    connection.execute(
+                        "UPDATE tasks SET depth = ?, "
+                        "state = CASE state WHEN 'done' THEN 'pending' ELSE state END "
+                        "WHERE job_id = ? AND url = ?",
+                        (depth, self.job_id, url)
+                    )
+
+    def claim(self, worker_id: str, lease: float = LEASE_SECONDS) -> Optional[Task]:
+        with self._transaction() as connection:
+            now = self._clock()
+            row = connection.execute(
+                "SELECT rowid, url, depth, indexed FROM tasks WHERE job_id = ? "
+                "AND state = 'leased' AND expires < ? ORDER BY expires LIMIT 1",
+                (self.job_id, now)
+            ).fetchone()
+
+            if row is None:
+                row = connection.execute(
+                    "SELECT rowid, url, depth, indexed FROM tasks WHERE job_id = ? "
+                    "AND state = 'pending' ORDER BY depth DESC, rowid LIMIT 1",
+                    (self.job_id,)
+                ).fetchone()
+
+            if row is None:
+                return None
+
+            connection.execute(
+                "UPDATE tasks SET state = 'leased', worker = ?, expires = ? WHERE rowid = ?",
+                (worker_id, now + lease, row[0])
+            )
+
+        return Task(row[1], row[2], not row[3])
+
+    def complete(self,
+                 worker_id: str,
+                 results: List[Tuple[str, int, Dict[Term, int]]]) -> int:
+        accepted = 0
+
+        with self._transaction() as connection:
+            for url, depth, counts in results:
+                row = connection.execute(
+                    "SELECT depth, indexed FROM tasks WHERE job_id = ? AND url = ? "
+                    "AND state = 'leased' AND worker = ?",
+                    (self.job_id, url, worker_id)
+                ).fetchone()
+
+                if row is None:
+                    continue
+
+                if not row[1]:
+                    connection.executemany(
+                        'INSERT INTO task_counts (job_id, term, count) VALUES (?, ?, ?) '
+                        'ON CONFLICT (job_id, term) DO UPDATE SET count = count + excluded.count',
+                        ((self.job_id, json.dumps(term), count)
+                         for term, count in encode_counts(counts))
+                    )
+
+                connection.execute(
+                    'UPDATE tasks SET state = ?, indexed = 1, worker = NULL '
+                    'WHERE job_id = ? AND url = ?',
+                    ('pending' if row[0] > depth else 'done', self.job_id, url)
+                )
+                accepted += 1
+
+        return accepted
+
+    def finished(self) -> bool:
+        with self._transaction() as connection:
+            row = connection.execute(
+                "SELECT 1 FROM tasks WHERE job_id = ? AND state IN ('pending', 'leased') LIMIT 1",
+                (self.job_id,)
+            ).fetchone()
+
+        return row is None
+
+    def counts(self) -> Dict[Term, int]:
+        with self._transaction() as connection:
+            rows = connection.execute('SELECT term, count FROM task_counts WHERE job_id = ?',
+                                      (self.job_id,)).fetchall()
+
+        return decode_counts([[json.loads(term), count] for term, count in rows])
+
+
+class RemoteWorkQueue(WorkQueue):
+    """Work queue for workers on other machines
+
+    This is a client for the ``/queue/<job_id>`` routes of the web app,
+    which are backed by a :class:`SQLiteWorkQueue` on the app's machine.
+
+    :param base_url: The url of the web app, for example http://indexer:8000
+    :type base_url: str
+    :param job_id: The id of the crawl job
+    :type job_id: str
+    :param token: The shared token of the queue routes
+    :type token: str, optional
+    """
+    def __init__(self, base_url: str, job_id: str, token: Optional[str] = None):
+        """Constructor method
+
+        :param base_url: The url of the web app
+        :type base_url: str
+        :param job_id: The id of the crawl job
+        :type job_id: str
+        :param token: The shared token of the queue routes
+        :type token: str, optional
+        """
+        self.base_url = base_url.rstrip('/')
+        self.job_id = job_id
+        self._session = requests.Session()
+
+        if token is not None:
+            self._session.headers['Authorization'] = f'Bearer {token}'
+
+    def _post(self, action: str, body: dict) -> dict:
+        """Call one of the queue routes
+
+        :param action: The name of the route
+        :type action: str
+        :param body: The JSON body of the request
+        :type body: dict
+        :return: The JSON body of the response
+        :rtype: dict
+        """
+        response = self._session.post(f'{self.base_url}/queue/{self.job_id}/{action}',
+                                      json=body,
+                                      timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+
+        return response.json()
+
+    def push_many(self, items: List[Tuple[str, int]]) -> None:
+        self._post('push', {'items': items})
+
+    def claim(self, worker_id: str, lease: float = LEASE_SECONDS) -> Optional[Task]:
+        task = self._post('claim', {'worker': worker_id, 'lease': lease})['task']
+
+        return Task(*task) if task is not None else None
+
+    def complete(self,
+                 worker_id: str,
+                 results: List[Tuple[str, int, Dict[Term, int]]]) -> int:
+        body = {
+            'worker': worker_id,
+            'results': [[url, depth, encode_counts(counts)] for url, depth, counts in results]
+        }
+
+        return self._post('complete', body)['accepted']
+
+    def finished(self) -> bool:
+        return self._post('status', {})['finished']
+
+    def counts(self) -> Dict[Term, int]:
+        return decode_counts(self._post('counts', {})['counts'])
+
+
+def open_queue(location: str, job_id: str, token: Optional[str] = None) -> WorkQueue:
+    """Open the work queue of a job
+
+    :param location: The url of a web app for a remote queue, or the path of
+        a SQLite database
+    :type location: str
+    :param job_id: The id of the crawl job
+    :type job_id: str
+    :param token: The shared token of the queue routes of a remote queue
+    :type token: str, optional
+    :return: The work queue
+    :rtype: :class:`levatas_indexer.distributed.WorkQueue`
+    """
+    if location.startswith(('http://', 'https://')):
+        return RemoteWorkQueue(location, job_id, token)
+
+    return SQLiteWorkQueue(job_id, location)
+
+
+def _complete(work_queue: WorkQueue,
+              worker_id: str,
+              results: List[Tuple[str, int, Dict[Term, int]]]) -> None:
+    """Send a batch of counts and warn about urls whose lease was lost
+
+    :param work_queue: The queue the urls were claimed from
+    :type work_queue: :class:`levatas_indexer.distributed.WorkQueue`
+    :param worker_id: The id of the worker holding the leases
+    :type worker_id: str
+    :param results: The url, depth and counts of each completed page
+    :type results: List[Tuple[str, int, Dict]]
+    """
+    accepted = work_queue.complete(worker_id, results)
+
+    if accepted < len(results):
+        logging.warning('Worker %s lost the lease on %d urls.',
+                        worker_id, len(results) - accepted)
+
+
+def _send_interval(lease: float) -> float:
+    """Get how long a worker can hold on to the results of the urls it
+    finished
+
+    This leaves time for one more url to be fetched before the lease on the
+    oldest result runs out, even if the fetch takes as long as it can.
+
+    :param lease: How many seconds the worker has to complete a url
+    :type lease: float
+    :return: The number of seconds after the oldest result was claimed that
+        the results must be sent by
+    :rtype: float
+    """
+    return max(lease - MAX_FETCH_SECONDS, 0.0) / 2
+
+
+def _fetch(task: Task, frontier: utils.Frontier, max_size: int) -> str:
+    """Fetch a claimed url once its host is ready
+
+    The url is passed through the worker's own frontier, which waits for
+    the host's turn, checks robots.txt and retries throttled fetches.
+
+    :param task: The claimed url
+    :type task: :class:`levatas_indexer.distributed.Task`
+    :param frontier: The frontier of the worker
+    :type frontier: :class:`levatas_indexer.utils.Frontier`
+    :param max_size: The maximum size in bytes of a document to index
+    :type max_size: int
+    :return: The text of the page, which is empty if the url was
+        disallowed, throttled for too long or couldn't be fetched
+    :rtype: str
+    """
+    frontier.push(task.url, task.depth)
+    text = ''
+
+    while (item := frontier.pop()) is not None:
+        text = utils.visit_page(item[0], 0, set(), frontier, max_size=max_size) or ''
+
+    return text
+
+
+def run_worker(work_queue: WorkQueue,
+               indexer,
+               worker_id: str,
+               frontier: Optional[utils.Frontier] = None,
+               options: WorkerOptions = WorkerOptions()) -> None:
+    """Claim, fetch and count urls from a work queue until the crawl is
+    finished
+
+    The links of each page are pushed as soon as the page is fetched, so
+    other workers can start on them, and the counts are sent back in
+    batches of batch_size pages. A batch is sent early once the lease on its
+    oldest url gets close to running out, so slow pages don't cost the
+    worker its leases. A url that can't be fetched is completed without
+    counts, and the counts of the current batch are still sent if the worker
+    stops on an error.
+
+    :param work_queue: The queue to take urls from
+    :type work_queue: :class:`levatas_indexer.distributed.WorkQueue`
+    :param indexer: The indexer used to count the pages
+    :type indexer: :class:`levatas_indexer.indexer.WordIndexer`
+    :param worker_id: A unique id for the worker
+    :type worker_id: str
+    :param frontier: The frontier that paces the worker's requests, see
+        :class:`levatas_indexer.scheduler.CrawlScheduler`. It must not be
+        shared with other workers.
+    :type frontier: :class:`levatas_indexer.utils.Frontier`, optional
+    :param options: The settings of the worker
+    :type options: :class:`levatas_indexer.distributed.WorkerOptions`,
+        optional
+    """
+    if frontier is None:
+        frontier = utils.Frontier()
+
+    results: List[Tuple[str, int, Dict[Term, int]]] = []
+    oldest = 0.0
+
+    try:
+        while True:
+            claimed = time.monotonic()
+            task = work_queue.claim(worker_id, options.lease)
+
+            if task is None:
+                if results:
+                    _complete(work_queue, worker_id, results)
+                    results = []
+                    continue
+
+                if work_queue.finished():
+                    return
+
+                time.sleep(options.poll_interval)
+                continue
+
+            text = _fetch(task, frontier, options.max_size)
+            counts: Dict[Term, int] = {}
+
+            if text and task.depth > 0:
+                links = utils.extract_links(task.url, text)
+                work_queue.push_many([(link, task.depth - 1) for link in links])
+
+            if text and task.needs_index:
+                counts = indexer.count_text(text)
+
+            if not results:
+                oldest = claimed
+
+            results.append((task.url, task.depth, counts))
+
+            if len(results) >= options.batch_size \
+                    or time.monotonic() - oldest >= _send_interval(options.lease):
+                _complete(work_queue, worker_id, results)
+                results = []
+
+    finally:
+        if results:
+            _complete(work_queue, worker_id, results)
+
+
+def join_crawl(location: str,
+               job_id: str,
+               worker_id: str,
+               options: WorkerOptions = WorkerOptions(),
+               token: Optional[str] = None) -> None:
+    """Work on a distributed crawl job until it is finished
+
+    The worker paces its requests to each host with its own
+    :class:`levatas_indexer.scheduler.CrawlScheduler`, which follows the
+    crawl-delay of robots.txt and backs off from throttled hosts. Hosts
+    that ask the worker to wait longer than it can hold its leases are
+    skipped.
+
+    :param location: The location of the work queue, see :func:`open_queue`
+    :type location: str
+    :param job_id: The id of the crawl job
+    :type job_id: str
+    :param worker_id: A unique id for the worker
+    :type worker_id: str
+    :param options: The settings of the worker
+    :type options: :class:`levatas_indexer.distributed.WorkerOptions`,
+        optional
+    :param token: The shared token of the queue routes of a remote queue
+    :type token: str, optional
+    """
+    robots = scheduler.RobotsCache() if options.respect_robots else None
+    frontier = scheduler.CrawlScheduler(rate=options.rate,
+                                        robots=robots,
+                                        max_wait=_send_interval(options.lease))
+
+    run_worker(open_queue(location, job_id, token),
+               indexers.get_default_indexer(ngram_size=options.ngram_size),
+               worker_id,
+               frontier,
+               options)
+
+
+# The queue, the crawl and the settings of its workers are all independent
+def crawl(url: str,  # pylint: disable=too-many-arguments
+          location: str,
+          job_id: str,
+          indexer,
+          *,
+          workers: int = 2,
+          depth: int = 1,
+          options: WorkerOptions = WorkerOptions(),
+          token: Optional[str] = None) -> dict:
+    """Coordinate a distributed crawl and merge the counts of the workers
+
+    The root url is pushed to the queue and the given number of worker
+    processes are started on this machine. Workers on other machines can
+    join the crawl at any time with ``bin/worker``. Once every url has been
+    completed the counts are merged into the given indexer.
+
+    :param url: The root url to fetch
+    :type url: str
+    :param location: The location of the work queue, see :func:`open_queue`
+    :type location: str
+    :param job_id: The id of the crawl job
+    :type job_id: str
+    :param indexer: The indexer to merge the counts into. Its ngram_size is
+        used by the local workers.
+    :type indexer: :class:`levatas_indexer.indexer.WordIndexer`
+    :param workers: The number of worker processes to start on this machine
+    :type workers: int, optional
+    :param depth: How deep to fetch documents.
+    :type depth: int, optional
+    :param options: The settings of the local workers. The poll interval is
+        also how often the crawl checks if it is finished.
+    :type options: :class:`levatas_indexer.distributed.WorkerOptions`,
+        optional
+    :param token: The shared token of the queue routes of a remote queue
+    :type token: str, optional
+    :return: A dictionary where the keys are words and the values are the
+        number of occurence for the given word
+    :rtype: dict
+    """
+    options = options._replace(ngram_size=indexer.ngram_size)
+    work_queue = open_queue(location, job_id, token)
+    work_queue.push(url, depth)
+    processes = [
+        multiprocessing.Process(target=join_crawl,
+                                args=(location, job_id, f'{job_id}-{uuid.uuid4().hex}',
+                                      options, token),
+                                daemon=True)
+        for _ in range(workers)
+    ]
+
+    for process in processes:
+        process.start()
+
+    try:
+        while not work_queue.finished():
+            if processes and all(process.exitcode not in (None, 0) for process in processes):
+                raise RuntimeError(f'Every worker of job {job_id} failed')
+
+            time.sleep(options.poll_interval)
+
+    finally:
+        for process in processes:
+            process.join(options.poll_interval)
+
+            if process.is_alive():
+                process.terminate()
+
+    indexer.merge(work_queue.counts())
+
+    return indexer.index
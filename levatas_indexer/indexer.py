@@ -9,12 +9,25 @@ It also contains helper funtioncs for getting a pre-configured default indexer
 and indexing web pages based on a root url.
 """
 from collections.abc import Callable
-from collections import defaultdict
-from typing import List, Literal, TypedDict
+from collections import Counter, defaultdict, deque
+from typing import (Deque, Dict, Iterable, Iterator, List, Literal, Optional, Sequence, Tuple,
+                    TypedDict, Union)
+import logging
+import re
 
 import nltk  # type: ignore
 
-from . import processors, utils
+from . import checkpoint as checkpoints
+from . import dedup, processors, utils
+
+CHECKPOINT_INTERVAL = 25
+NORMALIZE_CACHE_SIZE = 65536
+CHUNK_SIZE = 64 * 1024
+CHUNK_BOUNDARIES = (re.compile(r'\n'), re.compile(r'[.!?]\s'), re.compile(r'\s'))
+WHITESPACE = re.compile(r'\s')
+MAX_NGRAM_SIZE = 5
+WORD_ID_BITS = 32
+WORD_ID_MASK = (1 << WORD_ID_BITS) - 1
 
 
 class ProcessorDict(TypedDict):
@@ -46,6 +59,7 @@ class Tokenizer:
             'word': [],
             'document': []
         }
+        self._normalized: Dict[str, str] = {}
 
     def _process(self, type_: Literal['word', 'document'], document: str) -> str:
         """Iterate over the callbacks defined by type_ and invoke them on the
@@ -77,6 +91,7 @@ class Tokenizer:
         :type callback: Callable[[str], str]
         """
         self._processors['word'].append(callback)
+        self._normalized.clear()
 
     def add_document_processor(self, callback: Callable[[str], str]) -> None:
         """Add a document processor to the tokenizer
@@ -90,64 +105,208 @@ class Tokenizer:
         """
         self._processors['document'].append(callback)
 
-    def tokenize(self, document: str) -> List[str]:
-        """Split a body of text into individual tokens
+    def normalize(self, word: str) -> str:
+        """Run a single word through the word processors
+
+        This puts query terms into the same form as the tokens stored in an
+        index. Results are cached, since the same terms tend to be looked up
+        over and over.
+
+        :param word: The word to normalize
+        :type word: str
+        :return: The processed word
+        :rtype: str
+        """
+        normalized = self._normalized.get(word)
+
+        if normalized is None:
+            if len(self._normalized) >= NORMALIZE_CACHE_SIZE:
+                self._normalized.clear()
+
+            normalized = self._process('word', word)
+            self._normalized[word] = normalized
+
+        return normalized
+
+    def normalize_phrase(self, phrase: str) -> List[str]:
+        """Split a query into tokens and run each one through the word
+        processors
+
+        The query is split the same way documents are, so a query is one
+        token for a tokenizer that wouldn't split it and a phrase otherwise.
+
+        :param phrase: The query to normalize
+        :type phrase: str
+        :return: The processed tokens, leaving out any that were removed
+        :rtype: List[str]
+        """
+        tokens = (self.normalize(word) for word in self._iter_words(phrase))
+
+        return [token for token in tokens if token]
+
+    def _iter_words(self, document: str) -> Iterator[str]:
+        """Lazily split a processed document on the delimiter
+
+        This behaves like ``document.split(self.delimiter)`` without building
+        the list of words.
+
+        :param document: The processed body of text
+        :type document: str
+        :return: An iterator of the unprocessed words
+        :rtype: Iterator[str]
+        """
+        if not self.delimiter:
+            raise ValueError('empty delimiter')
+
+        start = 0
+
+        while (end := document.find(self.delimiter, start)) != -1:
+            yield document[start:end]
+            start = end + len(self.delimiter)
+
+        yield document[start:]
+
+    def iter_tokens(self, document: str) -> Iterator[str]:
+        """Lazily split a body of text into individual tokens
+
+        Tokens are produced one at a time as they are consumed, so the full
+        list of tokens is never held in memory.
 
         :param document: The body of text to tokenize
         :type document: str
-        :param
+        :return: An iterator of the processed tokens
+        :rtype: Iterator[str]
         """
-        tokens = []
         document = self._process('document', document)
 
-        for word in document.split(self.delimiter):
+        for word in self._iter_words(document):
             word = self._process('word', word)
 
             if not word:
                 continue
 
-            tokens.append(word)
+            yield word
+
+    def tokenize(self, document: str) -> List[str]:
+        """Split a body of text into individual tokens
+
+        :param document: The body of text to tokenize
+        :type document: str
+        :return: The processed tokens
+        :rtype: List[str]
+        """
+        return list(self.iter_tokens(document))
+
+
+def iter_chunks(text: str, chunk_size: int = CHUNK_SIZE) -> Iterator[str]:
+    """Split text into chunks of roughly chunk_size characters
+
+    Chunks never end part way through a word. A chunk ends at the last line
+    break in the second half of the chunk if there is one, otherwise at the
+    last sentence ending, otherwise at the last whitespace. A single word
+    longer than chunk_size is kept whole, and empty text is a single empty
+    chunk.
+
+    :param text: The text to split
+    :type text: str
+    :param chunk_size: The target number of characters in a chunk
+    :type chunk_size: int, optional
+    :return: An iterator of the chunks
+    :rtype: Iterator[str]
+    """
+    start = 0
+
+    while len(text) - start > chunk_size:
+        end = start + chunk_size
+        boundary = None
+
+        for pattern in CHUNK_BOUNDARIES:
+            for match in pattern.finditer(text, start + chunk_size // 2, end):
+                boundary = match.end()
 
-        return tokens
+            if boundary is not None:
+                break
+
+        if boundary is None:
+            whitespace = WHITESPACE.search(text, end)
+            boundary = whitespace.end() if whitespace else len(text)
+
+        yield text[start:boundary]
+        start = boundary
+
+    if start < len(text) or start == 0:
+        yield text[start:]
 
 
 class NLTKTokenizer(Tokenizer):
     """Subclass of :class:`levatas_indexer.indexer.Tokenizer` that uses the
     natural languate toolkit to tokenzie the text instead of splitting
+
+    The text is handed to the toolkit in chunks, see :func:`iter_chunks`,
+    so only the tokens of one chunk are held in memory at a time.
+
+    :param chunk_size: The target number of characters in a chunk
+    :type chunk_size: int
     """
-    def tokenize(self, document: str) -> List[str]:
-        """Split a body of text into individual tokens
+    def __init__(self, delimiter: str = ' ', chunk_size: int = CHUNK_SIZE):
+        """Constructor method
 
-        :param document: The body of text to tokenize
-        :type document: str
-        :param
+        :param delimiter: Unused, kept for compatibility with the base class
+        :type delimiter: str
+        :param chunk_size: The target number of characters in a chunk
+        :type chunk_size: int
         """
-        tokens = []
-        document = self._process('document', document)
+        super().__init__(delimiter)
+        self.chunk_size = chunk_size
 
-        for word in nltk.word_tokenize(document):
-            word = self._process('word', word)
-            tokens.append(word)
+    def _iter_words(self, document: str) -> Iterator[str]:
+        """Lazily tokenize a processed document with the toolkit
 
-        return tokens
+        :param document: The processed body of text
+        :type document: str
+        :return: An iterator of the unprocessed words
+        :rtype: Iterator[str]
+        """
+        for chunk in iter_chunks(document, self.chunk_size):
+            yield from nltk.word_tokenize(chunk)
 
 
 class WordIndexer:
     """Simple indexer to count the number of occurance of each word
 
+    The indexer can also count phrases of up to ngram_size consecutive
+    tokens, collected with a rolling window in the same pass over the
+    tokens. Phrases are stored compactly: each word is given a numeric id,
+    and the ids of a phrase are packed into a single integer key. The memory
+    used by phrases can be bounded by calling :meth:`prune` between
+    documents, at the cost of undercounting phrases that were pruned and
+    then seen again.
+
     :param tokenizer: A tokenizer for splitting the text
     :type tokenizer: :class:`levatas_indexer.indexer.Tokenizer`
+    :param ngram_size: The largest number of tokens in a phrase to count
+    :type ngram_size: int
     :param index: The running index for all documents processed
     :type index: dict
     """
-    def __init__(self, tokenizer):
+    def __init__(self, tokenizer, ngram_size: int = 1):
         """Constructor method
 
         :param tokenizer: An instance of a tokenizer to use
         :type tokenizer: :class:`levatas_indexer.indexer.Tokenizer`
+        :param ngram_size: The largest number of tokens in a phrase to count
+            (default=1, only count single words)
+        :type ngram_size: int, optional
         """
+        if not 1 <= ngram_size <= MAX_NGRAM_SIZE:
+            raise ValueError(f'ngram_size must be between 1 and {MAX_NGRAM_SIZE}')
+
         self.tokenizer = tokenizer
-        self._words = defaultdict(int)
+        self.ngram_size = ngram_size
+        self._words: Dict[str, int] = defaultdict(int)
+        self._phrases: Dict[int, int] = defaultdict(int)
+        self._word_ids: Dict[str, int] = {}
+        self._vocabulary: List[str] = ['']
 
     @property
     def index(self) -> dict:
@@ -158,30 +317,207 @@ class WordIndexer:
         """
         return dict(self._words)
 
-    def index_text(self, text: str) -> None:
+    @property
+    def phrases(self) -> Dict[Tuple[str, ...], int]:
+        """Property for accessing a copy of the phrase counts
+
+        The keys are tuples of the tokens in each phrase.
+        """
+        return {self._decode(key): count for key, count in self._phrases.items()}
+
+    def _encode(self, tokens: Sequence[str], add: bool = False) -> Optional[int]:
+        """Pack the ids of the tokens of a phrase into a single integer
+
+        :param tokens: The tokens of the phrase
+        :type tokens: Sequence[str]
+        :param add: Whether or not to give unknown tokens a new id
+        :type add: bool, optional
+        :return: The key of the phrase, or None if a token has no id
+        :rtype: int, optional
+        """
+        key = 0
+
+        for token in tokens:
+            word_id = self._word_ids.get(token)
+
+            if word_id is None:
+                if not add:
+                    return None
+
+                word_id = len(self._vocabulary)
+                self._word_ids[token] = word_id
+                self._vocabulary.append(token)
+
+            key = key << WORD_ID_BITS | word_id
+
+        return key
+
+    def _decode(self, key: int) -> Tuple[str, ...]:
+        """Unpack the key of a phrase back into its tokens
+
+        :param key: The key of the phrase
+        :type key: int
+        :return: The tokens of the phrase
+        :rtype: Tuple[str, ...]
+        """
+        tokens = []
+
+        while key:
+            tokens.append(self._vocabulary[key & WORD_ID_MASK])
+            key >>= WORD_ID_BITS
+
+        return tuple(reversed(tokens))
+
+    def _iter_terms(self, tokens: Iterable[str]) -> Iterator[Union[str, Tuple[str, ...]]]:
+        """Yield every token, followed by the phrases that end with it
+
+        :param tokens: The tokens of a document
+        :type tokens: Iterable[str]
+        :return: An iterator of tokens and tuples of tokens
+        :rtype: Iterator[Union[str, Tuple[str, ...]]]
+        """
+        window: Deque[str] = deque(maxlen=self.ngram_size)
+
+        for token in tokens:
+            yield token
+            window.append(token)
+
+            if len(window) > 1:
+                phrase = tuple(window)
+
+                for size in range(2, len(phrase) + 1):
+                    yield phrase[-size:]
+
+    def count_text(self, text: str) -> Counter:
+        """Count the words in a document without adding it to the index
+
+        This doesn't touch the running index, so it is safe to call from
+        several threads at once. When phrases are being counted the result
+        also has a key for each phrase, which is a tuple of its tokens.
+
+        :param text: A text document to count
+        :type text: str
+        :return: The number of occurrences of each word in the document
+        :rtype: :class:`collections.Counter`
+        """
+        tokens = self.tokenizer.iter_tokens(text)
+
+        if self.ngram_size == 1:
+            return Counter(tokens)
+
+        return Counter(self._iter_terms(tokens))
+
+    def index_text(self, text: str) -> Counter:
         """Add a document to the running index
 
+        The tokens of the document are tallied on their own first, which
+        happens in C, and the tally is then merged into the running index in
+        a single pass over the distinct words.
+
         :param text: A text document to index
         :type text: str
+        :return: The number of occurrences of each word in the document
+        :rtype: :class:`collections.Counter`
         """
-        for word in self.tokenizer.tokenize(text):
-            self._words[word] += 1
+        counts = self.count_text(text)
+        self.merge(counts)
+
+        return counts
+
+    def merge(self, counts: dict) -> None:
+        """Add the counts of another index to the running index
 
-    def count(self, word: str) -> int:
+        :param counts: A dictionary where the keys are words, or tuples of
+            the tokens of a phrase, and the values are the number of
+            occurrences
+        :type counts: dict
+        """
+        for word, count in counts.items():
+            if not isinstance(word, tuple):
+                self._words[word] += count
+                continue
+
+            key = self._encode(word, add=True)
+
+            if key is not None:
+                self._phrases[key] += count
+
+    def prune(self, min_count: int) -> None:
+        """Drop the phrases that have been seen fewer than min_count times
+
+        :param min_count: The minimum count of a phrase to keep
+        :type min_count: int
+        """
+        self._phrases = defaultdict(int, {
+            key: count for key, count in self._phrases.items() if count >= min_count
+        })
+
+    def count(self, word: Union[str, Tuple[str, ...]]) -> int:
         """Get the number of occurrences of the given word in the indexed
         documents
 
-        :param word: The word to search for
-        :type word: str
+        A phrase can be counted by passing a tuple of its tokens.
+
+        :param word: The word, or tuple of the tokens of a phrase, to search
+            for
+        :type word: Union[str, Tuple[str, ...]]
         :return: The number of occurrences of a given word
         :rtype: int
         """
+        if isinstance(word, tuple):
+            return self._count_phrase(word)
+
         return self._words.get(word, 0)
 
+    def _count_phrase(self, tokens: Sequence[str]) -> int:
+        """Get the number of occurrences of a phrase
+
+        :param tokens: The tokens of the phrase
+        :type tokens: Sequence[str]
+        :return: The number of occurrences of the phrase
+        :rtype: int
+        """
+        if not tokens or len(tokens) > self.ngram_size:
+            return 0
+
+        if len(tokens) == 1:
+            return self._words.get(tokens[0], 0)
+
+        key = self._encode(tokens)
+
+        return self._phrases.get(key, 0) if key is not None else 0
+
+    def query(self, words: Union[str, Iterable[str]]) -> Dict[str, int]:
+        """Get the number of occurrences of each of the given words
+
+        Unlike :meth:`count`, the words are run through the word processors
+        of the tokenizer first, so they are matched in the same form they
+        were indexed in. For example "Running" will match the stem "run".
+        Words that the tokenizer splits into several tokens are counted as
+        phrases.
+
+        :param words: The word, or words, to search for
+        :type words: Union[str, Iterable[str]]
+        :return: A dictionary where the keys are the given words and the
+            values are the number of occurrences of the word
+        :rtype: Dict[str, int]
+        """
+        if isinstance(words, str):
+            words = [words]
+
+        counts = {}
+
+        for word in words:
+            counts[word] = self._count_phrase(self.tokenizer.normalize_phrase(word))
+
+        return counts
+
 
-def get_default_indexer() -> WordIndexer:
+def get_default_indexer(ngram_size: int = 1) -> WordIndexer:
     """Retrieve and instance of a pre-configured word indexer
 
+    :param ngram_size: The largest number of tokens in a phrase to count
+    :type ngram_size: int, optional
     :return: An instance of an indexer
     :rtype: :class:`levatas_indexer.indexer.WordIndexer`
     """
@@ -190,24 +526,258 @@ def get_default_indexer() -> WordIndexer:
     tokenizer.add_word_processor(processors.cast_text_to_lower)
     tokenizer.add_word_processor(processors.stem_word)
 
-    return WordIndexer(tokenizer)
+    return WordIndexer(tokenizer, ngram_size=ngram_size)
+
+
+class _TrackedSet(set):
+    """A set that remembers the items added to it since they were last taken"""
+    def __init__(self, items: Iterable = ()):
+        """Constructor method
+
+        :param items: The initial items, which are not remembered as added
+        :type items: Iterable, optional
+        """
+        super().__init__(items)
+        self._added: list = []
 
+    def add(self, item) -> None:
+        if item not in self:
+            self._added.append(item)
 
-def index_html_documents(url: str, indexer: WordIndexer) -> dict:
+        super().add(item)
+
+    def update(self, *others: Iterable) -> None:
+        for other in others:
+            for item in other:
+                self.add(item)
+
+    def take_added(self) -> list:
+        """Get the items added since the last call and forget them
+
+        :return: The added items in the order they were added
+        :rtype: list
+        """
+        added, self._added = self._added, []
+
+        return added
+
+
+class _CheckpointWriter:  # pylint: disable=too-few-public-methods
+    """Save the progress of a crawl, writing only what changed since the
+    previous save
+
+    :param checkpoint: The checkpoint to save to
+    :type checkpoint: :class:`levatas_indexer.checkpoint.Checkpoint`
+    :param url: The root url of the crawl
+    :type url: str
+    :param frontier: The frontier of the crawl
+    :type frontier: :class:`levatas_indexer.utils.Frontier`
+    :param visted: The urls already queued by the crawl
+    :type visted: :class:`levatas_indexer.indexer._TrackedSet`
+    :param duplicate_filter: The duplicate filter of the crawl
+    :type duplicate_filter: :class:`levatas_indexer.dedup.DuplicateFilter`,
+        optional
+    :param counts: The counts of the documents indexed since the previous
+        save
+    :type counts: :class:`collections.Counter`
+    """
+    def __init__(self,
+                 checkpoint: checkpoints.Checkpoint,
+                 url: str,
+                 frontier: utils.Frontier,
+                 visted: _TrackedSet,
+                 duplicate_filter: Optional[dedup.DuplicateFilter]):
+        """Constructor method
+
+        :param checkpoint: The checkpoint to save to
+        :type checkpoint: :class:`levatas_indexer.checkpoint.Checkpoint`
+        :param url: The root url of the crawl
+        :type url: str
+        :param frontier: The frontier of the crawl
+        :type frontier: :class:`levatas_indexer.utils.Frontier`
+        :param visted: The urls already queued by the crawl
+        :type visted: :class:`levatas_indexer.indexer._TrackedSet`
+        :param duplicate_filter: The duplicate filter of the crawl
+        :type duplicate_filter: :class:`levatas_indexer.dedup.DuplicateFilter`,
+            optional
+        """
+        self.checkpoint = checkpoint
+        self.url = url
+        self.frontier = frontier
+        self.visted = visted
+        self.duplicate_filter = duplicate_filter
+        self.counts: Counter = Counter()
+        self._saved_fingerprints = len(duplicate_filter.fingerprints) if duplicate_filter else 0
+
+    def save(self, complete: bool = False) -> None:
+        """Save the progress made since the previous save
+
+        :param complete: Whether or not the crawl finished
+        :type complete: bool, optional
+        """
+        words = {word: count for word, count in self.counts.items() if isinstance(word, str)}
+        phrases = {phrase: count for phrase, count in self.counts.items()
+                   if isinstance(phrase, tuple)}
+        fingerprints: List[Tuple[str, int]] = []
+        skipped = 0
+
+        if self.duplicate_filter is not None:
+            fingerprints = self.duplicate_filter.fingerprints_since(self._saved_fingerprints)
+            skipped = self.duplicate_filter.skipped
+
+        self.checkpoint.save(self.url, self.frontier.pending(), self.visted.take_added(), words,
+                             phrases=phrases, fingerprints=fingerprints,
+                             skipped=skipped, complete=complete)
+        self._saved_fingerprints += len(fingerprints)
+        self.counts.clear()
+
+
+def _resume(state: checkpoints.CheckpointState,
+            indexer: WordIndexer,
+            frontier: utils.Frontier,
+            duplicate_filter: Optional[dedup.DuplicateFilter]) -> _TrackedSet:
+    """Restore the progress of a crawl from its checkpoint
+
+    :param state: The progress loaded from the checkpoint
+    :type state: :class:`levatas_indexer.checkpoint.CheckpointState`
+    :param indexer: The indexer to add the saved counts to
+    :type indexer: :class:`levatas_indexer.indexer.WordIndexer`
+    :param frontier: The frontier to add the pending urls to
+    :type frontier: :class:`levatas_indexer.utils.Frontier`
+    :param duplicate_filter: The filter to add the saved fingerprints to
+    :type duplicate_filter: :class:`levatas_indexer.dedup.DuplicateFilter`,
+        optional
+    :return: The urls already queued by the crawl
+    :rtype: :class:`levatas_indexer.indexer._TrackedSet`
+    """
+    if state.visited:
+        logging.info('Resuming crawl (url: %s, pending: %d).', state.url, len(state.pending))
+
+    indexer.merge(state.counts)
+    indexer.merge(state.phrases)
+
+    for pending_url, depth in state.pending:
+        frontier.push(pending_url, depth)
+
+    if duplicate_filter is not None:
+        duplicate_filter.skipped = state.skipped
+
+        for digest, fingerprint in state.fingerprints:
+            duplicate_filter.add(digest, fingerprint)
+
+    return _TrackedSet(state.visited)
+
+
+def _index_document(indexer: WordIndexer,
+                    document: str,
+                    duplicate_filter: Optional[dedup.DuplicateFilter]) -> Optional[Counter]:
+    """Index a document unless it duplicates a document already indexed
+
+    :param indexer: The indexer to use for indexing the document
+    :type indexer: :class:`levatas_indexer.indexer.WordIndexer`
+    :param document: The document to index
+    :type document: str
+    :param duplicate_filter: A filter used to skip duplicate documents
+    :type duplicate_filter: :class:`levatas_indexer.dedup.DuplicateFilter`,
+        optional
+    :return: The counts of the document, or None if it was skipped
+    :rtype: :class:`collections.Counter`, optional
+    """
+    if duplicate_filter is not None and duplicate_filter.is_duplicate(document):
+        return None
+
+    return indexer.index_text(document)
+
+
+# The crawl, its deduplication and its checkpointing are all configured here
+def index_html_documents(url: str,  # pylint: disable=too-many-arguments
+                         indexer: WordIndexer,
+                         *,
+                         max_size: int = utils.MAX_PAGE_SIZE,
+                         duplicate_filter: Optional[dedup.DuplicateFilter] = None,
+                         frontier: Optional[utils.Frontier] = None,
+                         checkpoint: Optional[checkpoints.Checkpoint] = None,
+                         checkpoint_interval: int = CHECKPOINT_INTERVAL,
+                         document_counts: Optional[Dict[str, Counter]] = None) -> dict:
     """Index HTML documents supplied by the given URL
 
     This will process the html document returned by the given url, as well as
     the html documents of any embedded hyperlinks up to one level deep.
 
+    When a checkpoint is given the progress of the crawl is saved every
+    checkpoint_interval documents. If the checkpoint already holds progress
+    for the job, the crawl picks up where it left off instead of starting
+    over, and pages that were already indexed are not fetched again. The job
+    is held for the length of the crawl, and
+    :class:`levatas_indexer.checkpoint.JobLockedError` is raised if another
+    run is already crawling it.
+
     :param url: The root URL to use when retriving the xml documents
     :type url: str
     :param indexer: The indexer to use for indexing the documents
     :type indexer: :class:`levatas_indexer.indexer.WordIndexer`
+    :param max_size: The maximum size in bytes of a document to index
+    :type max_size: int, optional
+    :param duplicate_filter: A filter used to skip documents that duplicate
+        documents already indexed
+    :type duplicate_filter: :class:`levatas_indexer.dedup.DuplicateFilter`,
+        optional
+    :param frontier: The frontier that decides the order pages are fetched
+        in, see :class:`levatas_indexer.scheduler.CrawlScheduler`
+    :type frontier: :class:`levatas_indexer.utils.Frontier`, optional
+    :param checkpoint: The checkpoint used to save and resume the crawl
+    :type checkpoint: :class:`levatas_indexer.checkpoint.Checkpoint`, optional
+    :param checkpoint_interval: How many documents to index between saves
+    :type checkpoint_interval: int, optional
+    :param document_counts: A dictionary that, if given, is filled with the
+        word counts of each indexed document keyed by url
+    :type document_counts: Dict[str, :class:`collections.Counter`], optional
     :return: A dictionary where the keys are words and the values are the
         number of occurence for the given word
     :rtype: dict
     """
-    for document in utils.fetch_documents(url, set()):
-        indexer.index_text(document)
+    frontier = frontier if frontier is not None else utils.Frontier()
+
+    if checkpoint is not None and not checkpoint.acquire(url):
+        raise checkpoints.JobLockedError(f'Job {checkpoint.job_id} is already being crawled')
+
+    try:
+        visted = _TrackedSet()
+        writer = None
+
+        if checkpoint is not None:
+            state = checkpoint.load()
+
+            if state is not None:
+                url = state.url
+                visted = _resume(state, indexer, frontier, duplicate_filter)
+
+                if state.complete:
+                    return indexer.index
+
+            writer = _CheckpointWriter(checkpoint, url, frontier, visted, duplicate_filter)
+
+        for position, (page_url, document) in enumerate(
+                utils.crawl_pages(url, visted, max_size=max_size, frontier=frontier), 1):
+            counts = _index_document(indexer, document, duplicate_filter)
+
+            if document_counts is not None and counts is not None:
+                document_counts[page_url] = counts
+
+            if writer is not None and counts is not None:
+                writer.counts.update(counts)
+
+            if writer is not None and position % checkpoint_interval == 0:
+                writer.save()
+
+        if writer is not None:
+            writer.save(complete=True)
+
+    finally:
+        if checkpoint is not None:
+            checkpoint.release()
+
+    if duplicate_filter is not None:
+        logging.info('Skipped %d duplicate documents (url: %s).', duplicate_filter.skipped, url)
 
     return indexer.index
@@ -1,6 +1,11 @@
 """Static path information should be defined here"""
+import os
 import pathlib
 
 
 ROOT_DIR = pathlib.Path(__file__).parent.resolve()
 LOGGING_PATH = str(ROOT_DIR.joinpath('logging.json'))
+CHECKPOINT_PATH = os.environ.get('CHECKPOINT_PATH',
+                                 str(ROOT_DIR.parent.joinpath('checkpoints.sqlite3')))
+QUEUE_PATH = os.environ.get('QUEUE_PATH',
+                            str(ROOT_DIR.parent.joinpath('queue.sqlite3')))
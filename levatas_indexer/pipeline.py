@@ -0,0 +1,330 @@
+"""Pipelined crawling
+
+This module overlaps fetching pages with indexing them. Fetcher threads take
+urls from a frontier, download the pages and queue their links, then hand
+the pages to parser threads through a bounded queue. Network waits release
+the GIL, so parsers keep the CPU busy while fetchers wait on the network.
+
+The page queue is bounded, so when the parsers fall behind the fetchers
+block instead of piling pages up in memory. The first error raised by any
+thread stops the whole pipeline and is re-raised by :meth:`CrawlPipeline.run`.
+"""
+from collections import Counter
+from typing import Dict, Optional, Tuple
+import logging
+import queue
+import threading
+import time
+
+from . import utils
+
+POLL_INTERVAL = 0.1
+SHUTDOWN_TIMEOUT = 1.0
+
+
+# The threads, queues and metrics of the pipeline are all shared state
+class CrawlPipeline:  # pylint: disable=too-many-instance-attributes
+    """Crawl and index pages with separate fetcher and parser threads
+
+    The frontier is shared by all of the fetchers, so it must be safe to use
+    from several threads. Both :class:`levatas_indexer.utils.Frontier` and
+    :class:`levatas_indexer.scheduler.CrawlScheduler` are. When a thread
+    fails the frontier is closed, so fetchers waiting on it wake up.
+
+    :param indexer: The indexer to use for indexing the documents
+    :type indexer: :class:`levatas_indexer.indexer.WordIndexer`
+    :param fetchers: The number of fetcher threads
+    :type fetchers: int
+    :param parsers: The number of parser threads
+    :type parsers: int
+    :param max_queue: The maximum number of fetched pages waiting to be
+        parsed
+    :type max_queue: int
+    :param max_size: The maximum size in bytes of a document to index
+    :type max_size: int
+    :param frontier: The frontier that decides the order pages are fetched in
+    :type frontier: :class:`levatas_indexer.utils.Frontier`
+    :param duplicate_filter: A filter used to skip documents that duplicate
+        documents already indexed
+    :type duplicate_filter: :class:`levatas_indexer.dedup.DuplicateFilter`
+    :param document_counts: A dictionary that, if given, is filled with the
+        word counts of each indexed document keyed by url
+    :type document_counts: Dict[str, :class:`collections.Counter`]
+    """
+    # Each argument sizes or plugs in a separate stage of the pipeline
+    def __init__(self,  # pylint: disable=too-many-arguments
+                 indexer,
+                 *,
+                 fetchers: int = 4,
+                 parsers: int = 1,
+                 max_queue: int = 16,
+                 max_size: int = utils.MAX_PAGE_SIZE,
+                 frontier: Optional[utils.Frontier] = None,
+                 duplicate_filter=None,
+                 document_counts: Optional[Dict[str, Counter]] = None):
+        """Constructor method
+
+        :param indexer: The indexer to use for indexing the documents
+        :type indexer: :class:`levatas_indexer.indexer.WordIndexer`
+        :param fetchers: The number of fetcher threads
+        :type fetchers: int, optional
+        :param parsers: The number of parser threads
+        :type parsers: int, optional
+        :param max_queue: The maximum number of fetched pages waiting to be
+            parsed
+        :type max_queue: int, optional
+        :param max_size: The maximum size in bytes of a document to index
+        :type max_size: int, optional
+        :param frontier: The frontier that decides the order pages are
+            fetched in
+        :type frontier: :class:`levatas_indexer.utils.Frontier`, optional
+        :param duplicate_filter: A filter used to skip documents that
+            duplicate documents already indexed
+        :type duplicate_filter: :class:`levatas_indexer.dedup.DuplicateFilter`,
+            optional
+        :param document_counts: A dictionary that, if given, is filled with
+            the word counts of each indexed document keyed by url
+        :type document_counts: Dict[str, :class:`collections.Counter`],
+            optional
+        """
+        if fetchers < 1 or parsers < 1 or max_queue < 1:
+            raise ValueError('fetchers, parsers and max_queue must be at least 1')
+
+        self.indexer = indexer
+        self.fetchers = fetchers
+        self.parsers = parsers
+        self.max_size = max_size
+        self.frontier = frontier if frontier is not None else utils.Frontier()
+        self.duplicate_filter = duplicate_filter
+        self.document_counts = document_counts
+        self.visted: set = set()
+        self._pages: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._fetching_done = threading.Event()
+        self._work = threading.Condition()
+        self._active = 0
+        self._fetching = 0
+        self._lock = threading.Lock()
+        self._error: Optional[BaseException] = None
+        self._metrics: Dict[str, float] = dict.fromkeys((
+            'fetched', 'indexed', 'skipped', 'max_queued',
+            'fetch_seconds', 'index_seconds', 'blocked_seconds', 'starved_seconds'
+        ), 0)
+
+    @property
+    def metrics(self) -> dict:
+        """Property for accessing a snapshot of the pipeline's metrics
+
+        Alongside the running totals this includes the current depth of each
+        stage: urls waiting in the frontier, pages being fetched and pages
+        queued for the parsers. Fetchers that spend a lot of time blocked on
+        a full queue mean more parsers are needed, and parsers that spend a
+        lot of time starved mean more fetchers are needed.
+        """
+        with self._lock:
+            metrics = dict(self._metrics)
+
+        metrics['frontier'] = len(self.frontier)
+        metrics['fetching'] = self._fetching
+        metrics['queued'] = self._pages.qsize()
+
+        return metrics
+
+    def _add_metric(self, name: str, value: float) -> None:
+        """Add to one of the running totals
+
+        :param name: The name of the metric
+        :type name: str
+        :param value: The amount to add
+        :type value: float
+        """
+        with self._lock:
+            self._metrics[name] += value
+
+    def _fail(self, error: BaseException) -> None:
+        """Record the first error raised by a thread and stop the pipeline
+
+        :param error: The error that was raised
+        :type error: BaseException
+        """
+        with self._lock:
+            if self._error is None:
+                self._error = error
+
+        self._stop.set()
+        self.frontier.close()
+
+    def _claim(self) -> Optional[Tuple[str, int]]:
+        """Take the next url from the frontier
+
+        The frontier can be empty while other fetchers are still working on
+        pages whose links haven't been queued yet, so an empty frontier only
+        ends the crawl once no fetcher is active. Fetchers waiting on the
+        frontier count as active, but are only counted as fetching once
+        they have a url.
+
+        :return: A tuple of the url and its depth, or None if the crawl is
+            finished or stopped
+        :rtype: Tuple[str, int], optional
+        """
+        while not self._stop.is_set():
+            with self._work:
+                self._active += 1
+
+            item = self.frontier.pop()
+
+            with self._work:
+                if item is not None:
+                    self._fetching += 1
+                    return item
+
+                self._active -= 1
+
+                if self._active == 0 and len(self.frontier) == 0:
+                    self._fetching_done.set()
+                    self._work.notify_all()
+
+                if self._fetching_done.is_set():
+                    return None
+
+                self._work.wait(POLL_INTERVAL)
+
+        return None
+
+    def _release(self) -> None:
+        """Mark a claimed url as finished and wake any waiting fetchers"""
+        with self._work:
+            self._active -= 1
+            self._fetching -= 1
+            self._work.notify_all()
+
+    def _put(self, page: Tuple[str, str]) -> None:
+        """Queue a fetched page for the parsers, waiting while the queue is
+        full
+
+        :param page: A tuple of the url and text of the page
+        :type page: Tuple[str, str]
+        """
+        start = time.monotonic()
+
+        while not self._stop.is_set():
+            try:
+                self._pages.put(page, timeout=POLL_INTERVAL)
+                break
+
+            except queue.Full:
+                continue
+
+        self._add_metric('blocked_seconds', time.monotonic() - start)
+
+        with self._lock:
+            self._metrics['max_queued'] = max(self._metrics['max_queued'], self._pages.qsize())
+
+    def _fetch(self) -> None:
+        """Fetcher thread: fetch pages from the frontier until it is empty"""
+        try:
+            while (item := self._claim()) is not None:
+                try:
+                    url, depth = item
+                    start = time.monotonic()
+                    text = utils.visit_page(url, depth, self.visted, self.frontier,
+                                            max_size=self.max_size, lock=self._lock)
+                    self._add_metric('fetch_seconds', time.monotonic() - start)
+
+                    if text is not None:
+                        self._add_metric('fetched', 1)
+                        self._put((url, text))
+
+                finally:
+                    self._release()
+
+        except BaseException as error:  # pylint: disable=broad-except
+            self._fail(error)
+
+    def _parse(self) -> None:
+        """Parser thread: index pages from the queue until fetching is done"""
+        try:
+            while not self._stop.is_set():
+                start = time.monotonic()
+
+                try:
+                    url, text = self._pages.get(timeout=POLL_INTERVAL)
+
+                except queue.Empty:
+                    self._add_metric('starved_seconds', time.monotonic() - start)
+
+                    if self._fetching_done.is_set() and self._pages.empty():
+                        return
+
+                    continue
+
+                self._add_metric('starved_seconds', time.monotonic() - start)
+                start = time.monotonic()
+
+                if self.duplicate_filter is not None:
+                    with self._lock:
+                        duplicate = self.duplicate_filter.is_duplicate(text)
+
+                    if duplicate:
+                        self._add_metric('skipped', 1)
+                        continue
+
+                counts = self.indexer.count_text(text)
+
+                with self._lock:
+                    self.indexer.merge(counts)
+
+                    if self.document_counts is not None:
+                        self.document_counts[url] = counts
+
+                    self._metrics['indexed'] += 1
+                    self._metrics['index_seconds'] += time.monotonic() - start
+
+        except BaseException as error:  # pylint: disable=broad-except
+            self._fail(error)
+
+    def run(self, url: str, depth: int = 1) -> dict:
+        """Crawl and index the pages reachable from a url
+
+        :param url: The root url to fetch
+        :type url: str
+        :param depth: How deep to fetch documents.
+        :type depth: int, optional
+        :return: A dictionary where the keys are words and the values are the
+            number of occurence for the given word
+        :rtype: dict
+        """
+        if url not in self.visted:
+            self.visted.add(url)
+            self.frontier.push(url, depth)
+
+        threads = [
+            threading.Thread(target=self._fetch, name=f'fetcher-{i}', daemon=True)
+            for i in range(self.fetchers)
+        ] + [
+            threading.Thread(target=self._parse, name=f'parser-{i}', daemon=True)
+            for i in range(self.parsers)
+        ]
+
+        for thread in threads:
+            thread.start()
+
+        try:
+            for thread in threads:
+                while thread.is_alive() and self._error is None:
+                    thread.join(POLL_INTERVAL)
+
+        finally:
+            self._stop.set()
+            deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+
+            # Threads stuck in a request are left behind rather than waited on
+            for thread in threads:
+                thread.join(max(deadline - time.monotonic(), 0))
+
+        logging.info('Crawl pipeline finished (url: %s, metrics: %s).', url, self.metrics)
+
+        if self._error is not None:
+            raise self._error
+
+        return self.indexer.index
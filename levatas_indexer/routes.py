@@ -2,12 +2,26 @@
 
 This module contains all of the routes for the flask application.
 """
-from flask import Blueprint, jsonify, render_template, request
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+import hmac
+
+from flask import Blueprint, current_app, jsonify, render_template, request
 import validators  # type: ignore
 
-from . import indexer
+from . import checkpoint, dedup, distributed, indexer, pipeline, scheduler
+
+# Keeps throttled hosts from holding a request past gunicorn's worker timeout
+MAX_REQUEST_WAIT = 5.0
 
 app_bp = Blueprint('app', __name__)
+robots_cache = scheduler.RobotsCache()
+
+
+@app_bp.errorhandler(checkpoint.JobLockedError)
+def job_locked(error: checkpoint.JobLockedError):
+    """Refuse to crawl a job that another request is already crawling"""
+    return {'error': str(error)}, 409
 
 
 @app_bp.route('/')
@@ -16,15 +30,262 @@ def home():
     return render_template('index.html')
 
 
-@app_bp.route('/index')
+def _number_param(params, name: str, maximum: Optional[int] = None) -> int:
+    """Read a whole number of at least 1 from the parameters of a request
+
+    :param params: The query string or JSON body of the request
+    :type params: dict
+    :param name: The name of the parameter, which defaults to 1
+    :type name: str
+    :param maximum: The largest value allowed
+    :type maximum: int, optional
+    :raises ValueError: If the parameter isn't a whole number in range
+    :return: The value of the parameter
+    :rtype: int
+    """
+    value = params.get(name, 1)
+
+    if isinstance(value, str) and value.isdigit():
+        value = int(value)
+
+    if not isinstance(value, int) or isinstance(value, bool) or value < 1 \
+            or maximum is not None and value > maximum:
+        raise ValueError(f'{name} must be a number between 1 and {maximum}' if maximum
+                         else f'{name} must be a number of at least 1')
+
+    return value
+
+
+def _index_params() -> Tuple[str, str, List[str], int, int]:
+    """Read the parameters of an /index request from its query string or
+    JSON body
+
+    :raises ValueError: If any of the parameters are malformed
+    :return: The url, job id, words, ngram size and minimum phrase count of
+        the request
+    :rtype: Tuple[str, str, List[str], int, int]
+    """
+    if request.method == 'POST':
+        params = request.get_json(silent=True) or {}
+
+        if not isinstance(params, dict):
+            raise ValueError('The body must be a JSON object')
+
+        words = params.get('words', [])
+
+    else:
+        params = request.args
+        words = request.args.getlist('word')
+
+    url = params.get('url', '')
+    job_id = params.get('job', '')
+
+    if not isinstance(url, str) or not isinstance(job_id, str):
+        raise ValueError('The url and job must be strings')
+
+    if not isinstance(words, list) or not all(isinstance(word, str) for word in words):
+        raise ValueError('Words must be a list of strings')
+
+    ngram_size = _number_param(params, 'ngrams', indexer.MAX_NGRAM_SIZE)
+    min_phrase_count = _number_param(params, 'min_phrase_count')
+
+    return url, job_id, words, ngram_size, min_phrase_count
+
+
+@app_bp.route('/index', methods=['GET', 'POST'])
 def index_url():
-    """Index the documents specified by the URL"""
-    url = request.args.get('url', '')
+    """Index the documents specified by the URL
+
+    Pages are fetched and indexed concurrently, except for crawls given a
+    job id. Those are checkpointed as they go, and can be resumed by
+    requesting the same job id again. The url may be left out when resuming
+    a job.
+
+    If any words are given only the counts for those words are returned,
+    otherwise the whole index is returned. Large batches of words can be
+    sent as a JSON body with a POST request. Phrases of up to ngrams words
+    can be counted by separating the words of the phrase with spaces, and
+    phrases seen fewer than min_phrase_count times are left out.
+    """
+    try:
+        url, job_id, words, ngram_size, min_phrase_count = _index_params()
 
-    if not validators.url(url):
+    except ValueError as error:
+        return {'error': str(error)}, 400
+
+    default_indexer = indexer.get_default_indexer(ngram_size=ngram_size)
+    job_checkpoint = checkpoint.Checkpoint(job_id) if job_id else None
+    resuming = job_checkpoint is not None and job_checkpoint.exists()
+
+    if not validators.url(url) and not resuming:
         return {'error': 'Must include a valid url'}, 400
 
-    default_indexer = indexer.get_default_indexer()
-    result = indexer.index_html_documents(url, default_indexer)
+    duplicate_filter = dedup.DuplicateFilter()
+    crawl_scheduler = scheduler.CrawlScheduler(robots=robots_cache, max_wait=MAX_REQUEST_WAIT)
+
+    if job_checkpoint is not None:
+        result = indexer.index_html_documents(url,
+                                              default_indexer,
+                                              duplicate_filter=duplicate_filter,
+                                              frontier=crawl_scheduler,
+                                              checkpoint=job_checkpoint)
+
+    else:
+        crawl_pipeline = pipeline.CrawlPipeline(default_indexer,
+                                                frontier=crawl_scheduler,
+                                                duplicate_filter=duplicate_filter)
+        result = crawl_pipeline.run(url)
+
+    if min_phrase_count > 1:
+        default_indexer.prune(min_phrase_count)
+
+    if words:
+        return jsonify(default_indexer.query(words))
+
+    for phrase, count in default_indexer.phrases.items():
+        result[' '.join(phrase)] = count
 
     return jsonify(result)
+
+
+def _is_web_url(value) -> bool:
+    """Check that a value from a queue request is a valid http(s) url"""
+    return (isinstance(value, str)
+            and urlparse(value).scheme in ('http', 'https')
+            and bool(validators.url(value)))
+
+
+def _is_depth(value) -> bool:
+    """Check that a value from a queue request is a valid depth"""
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+
+def _is_counts(value) -> bool:
+    """Check that a value from a queue request is a list of encoded counts"""
+    return isinstance(value, list) and all(
+        isinstance(pair, list) and len(pair) == 2
+        and (isinstance(pair[0], str)
+             or isinstance(pair[0], list) and all(isinstance(token, str) for token in pair[0]))
+        and _is_depth(pair[1])
+        for pair in value
+    )
+
+
+def _is_authorized() -> bool:
+    """Check the shared token sent by a worker"""
+    expected = f"Bearer {current_app.config['QUEUE_TOKEN']}"
+    given = request.headers.get('Authorization', '')
+
+    return hmac.compare_digest(given.encode('utf-8'), expected.encode('utf-8'))
+
+
+def _worker_param(params: dict) -> str:
+    """Read the id of the worker sending a queue request
+
+    :param params: The JSON body of the request
+    :type params: dict
+    :raises ValueError: If the worker id is missing
+    :return: The worker id
+    :rtype: str
+    """
+    worker = params.get('worker')
+
+    if not isinstance(worker, str) or not worker:
+        raise ValueError('Must include a worker id')
+
+    return worker
+
+
+def _push(job_queue: distributed.SQLiteWorkQueue, params: dict) -> dict:
+    """Add the urls of a push request to the queue"""
+    items = params.get('items', [])
+
+    if not isinstance(items, list) or not all(
+            isinstance(item, list) and len(item) == 2
+            and _is_web_url(item[0]) and _is_depth(item[1])
+            for item in items):
+        raise ValueError('Items must be a list of valid http(s) urls and depths')
+
+    job_queue.push_many([(item[0], item[1]) for item in items])
+    return {}
+
+
+def _claim(job_queue: distributed.SQLiteWorkQueue, params: dict) -> dict:
+    """Lease the next url of the queue to the worker of a claim request"""
+    worker = _worker_param(params)
+    lease = params.get('lease', distributed.LEASE_SECONDS)
+
+    if not isinstance(lease, (int, float)) or isinstance(lease, bool) or lease <= 0:
+        raise ValueError('The lease must be a positive number of seconds')
+
+    task = job_queue.claim(worker, float(lease))
+    return {'task': list(task) if task is not None else None}
+
+
+def _complete(job_queue: distributed.SQLiteWorkQueue, params: dict) -> dict:
+    """Complete the urls of a complete request and merge their counts"""
+    worker = _worker_param(params)
+    results = params.get('results', [])
+
+    if not isinstance(results, list) or not all(
+            isinstance(result, list) and len(result) == 3
+            and isinstance(result[0], str) and _is_depth(result[1])
+            and _is_counts(result[2])
+            for result in results):
+        raise ValueError('Results must be a list of urls, depths and counts')
+
+    return {'accepted': job_queue.complete(worker, [
+        (url, depth, distributed.decode_counts(counts)) for url, depth, counts in results
+    ])}
+
+
+def _status(job_queue: distributed.SQLiteWorkQueue, _params: dict) -> dict:
+    """Report whether the crawl of the queue is finished"""
+    return {'finished': job_queue.finished()}
+
+
+def _counts(job_queue: distributed.SQLiteWorkQueue, _params: dict) -> dict:
+    """Send the merged counts of the queue"""
+    return {'counts': distributed.encode_counts(job_queue.counts())}
+
+
+QUEUE_ACTIONS: Dict[str, Callable[[distributed.SQLiteWorkQueue, dict], dict]] = {
+    'push': _push,
+    'claim': _claim,
+    'complete': _complete,
+    'status': _status,
+    'counts': _counts
+}
+
+
+@app_bp.route('/queue/<job_id>/<action>', methods=['POST'])
+def work_queue(job_id: str, action: str):
+    """Serve the work queue of a distributed crawl job
+
+    These routes back :class:`levatas_indexer.distributed.RemoteWorkQueue`,
+    so workers on other machines can share the queue stored on this one.
+    They are only served when the app is configured with a QUEUE_TOKEN,
+    and workers must send it as a bearer token.
+    """
+    if not current_app.config.get('QUEUE_TOKEN'):
+        return {'error': 'The work queue is not enabled'}, 404
+
+    if not _is_authorized():
+        return {'error': 'Invalid queue token'}, 401
+
+    if action not in QUEUE_ACTIONS:
+        return {'error': f'Unknown queue action: {action}'}, 404
+
+    params = request.get_json(silent=True)
+
+    if params is None:
+        params = {}
+
+    if not isinstance(params, dict):
+        return {'error': 'The body must be a JSON object'}, 400
+
+    try:
+        return QUEUE_ACTIONS[action](distributed.SQLiteWorkQueue(job_id), params)
+
+    except ValueError as error:
+        return {'error': str(error)}, 400
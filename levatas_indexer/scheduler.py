@@ -0,0 +1,554 @@
+"""Polite crawl scheduling
+
+This module provides a frontier for :func:`levatas_indexer.utils.crawl_pages`
+that paces requests per host. Every host gets a token bucket whose rate
+adapts to how the host is responding: it speeds up while responses are fast,
+slows down when responses are slow, and backs off entirely when the host
+answers with 429 or 503 and a Retry-After header. Robots.txt is fetched once
+per host, cached, and used both to skip disallowed urls and to cap the rate
+at the host's crawl-delay.
+
+Urls are kept in per-host queues and the next url is always taken from the
+host that can be fetched soonest, so a slow or throttled host doesn't hold
+up the rest of the crawl.
+"""
+from collections import OrderedDict, deque
+from collections.abc import Callable
+from datetime import datetime, timezone
+from typing import Deque, Dict, List, NamedTuple, Optional, Tuple
+from urllib.robotparser import RobotFileParser
+import email.utils
+import logging
+import threading
+import time
+import urllib.parse
+
+import requests
+
+from . import utils
+
+ROBOTS_TIMEOUT = 10
+MAX_RETRY_AFTER = 300.0
+MAX_ATTEMPTS = 3
+THROTTLE_STATUSES = frozenset({429, 503})
+
+
+def get_host(url: str) -> str:
+    """Get the scheme and host of a url
+
+    :param url: The url to parse
+    :type url: str
+    :return: The scheme and host, for example https://google.com
+    :rtype: str
+    """
+    parsed = urllib.parse.urlparse(url)
+
+    return f'{parsed.scheme}://{parsed.netloc}'
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse the value of a Retry-After header
+
+    The header may either be a number of seconds or an http date.
+
+    :param value: The value of the header
+    :type value: str, optional
+    :return: The number of seconds to wait, or None if the value is missing
+        or invalid
+    :rtype: float, optional
+    """
+    if not value:
+        return None
+
+    value = value.strip()
+
+    if value.isdigit():
+        return float(value)
+
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+
+    except (TypeError, ValueError):
+        return None
+
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+class TokenBucket:
+    """Token bucket with a rate that can be adjusted as a host responds
+
+    Tokens are reserved rather than taken, so the bucket can go negative and
+    callers are told how long to wait for their reservation instead of
+    polling for a free token.
+
+    :param rate: The number of tokens added per second
+    :type rate: float
+    :param capacity: The maximum number of tokens the bucket can hold
+    :type capacity: float
+    :param min_rate: The lowest the rate will be lowered to
+    :type min_rate: float
+    :param max_rate: The highest the rate will be raised to
+    :type max_rate: float
+    """
+    def __init__(self,
+                 rate: float,
+                 capacity: float,
+                 min_rate: float,
+                 max_rate: float,
+                 now: float):
+        """Constructor method
+
+        :param rate: The number of tokens added per second
+        :type rate: float
+        :param capacity: The maximum number of tokens the bucket can hold
+        :type capacity: float
+        :param min_rate: The lowest the rate will be lowered to
+        :type min_rate: float
+        :param max_rate: The highest the rate will be raised to
+        :type max_rate: float
+        :param now: The current time
+        :type now: float
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.tokens = capacity
+        self.blocked_until = 0.0
+        self._updated = now
+
+    def _refill(self, now: float) -> None:
+        """Add the tokens earned since the last update
+
+        :param now: The current time
+        :type now: float
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self, now: float) -> float:
+        """Get how long until a token is available
+
+        :param now: The current time
+        :type now: float
+        :return: The number of seconds to wait
+        :rtype: float
+        """
+        self._refill(now)
+        wait = max(self.blocked_until - now, 0.0)
+
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+
+        return wait
+
+    def reserve(self, now: float) -> float:
+        """Reserve a token
+
+        :param now: The current time
+        :type now: float
+        :return: The number of seconds to wait before using the token
+        :rtype: float
+        """
+        wait = self.delay(now)
+        self.tokens -= 1
+
+        return wait
+
+    def limit(self, max_rate: float) -> None:
+        """Lower the maximum rate of the bucket
+
+        :param max_rate: The new maximum rate
+        :type max_rate: float
+        """
+        self.max_rate = min(self.max_rate, max_rate)
+        self.min_rate = min(self.min_rate, self.max_rate)
+        self.rate = min(self.rate, self.max_rate)
+
+    def speed_up(self, step: float) -> None:
+        """Additively increase the rate
+
+        :param step: The amount to increase the rate by
+        :type step: float
+        """
+        self.rate = min(self.rate + step, self.max_rate)
+
+    def slow_down(self, factor: float) -> None:
+        """Multiplicatively decrease the rate
+
+        :param factor: The amount to multiply the rate by
+        :type factor: float
+        """
+        self.rate = max(self.rate * factor, self.min_rate)
+
+    def block(self, now: float, seconds: float) -> None:
+        """Stop handing out tokens for a period of time
+
+        :param now: The current time
+        :type now: float
+        :param seconds: How long to stop for
+        :type seconds: float
+        """
+        self._refill(now)
+        self.tokens = min(self.tokens, 0.0)
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+
+class RobotsRules(NamedTuple):
+    """The robots.txt rules of a host
+
+    :param parser: The parsed robots.txt
+    :type parser: :class:`urllib.robotparser.RobotFileParser`
+    :param allow_all: True if every url is allowed, False if every url is
+        disallowed, or None if the parser decides
+    :type allow_all: bool, optional
+    """
+    parser: RobotFileParser
+    allow_all: Optional[bool] = None
+
+
+class RobotsCache:
+    """Fetch and cache the robots.txt of each host
+
+    The cache is safe to share between crawls and threads. Hosts whose
+    robots.txt can't be fetched are treated as allowing everything, except
+    for 401 and 403 responses which disallow everything.
+
+    :param user_agent: The user agent to check the rules against
+    :type user_agent: str
+    :param max_age: How many seconds to keep a robots.txt before fetching it
+        again
+    :type max_age: float
+    """
+    def __init__(self,
+                 user_agent: str = utils.USER_AGENT,
+                 max_age: float = 24 * 60 * 60,
+                 clock: Callable[[], float] = time.monotonic):
+        """Constructor method
+
+        :param user_agent: The user agent to check the rules against
+        :type user_agent: str, optional
+        :param max_age: How many seconds to keep a robots.txt before fetching
+            it again
+        :type max_age: float, optional
+        :param clock: Function returning the current time in seconds
+        :type clock: Callable[[], float], optional
+        """
+        self.user_agent = user_agent
+        self.max_age = max_age
+        self._clock = clock
+        self._rules: Dict[str, Tuple[float, RobotsRules]] = {}
+        self._lock = threading.Lock()
+
+    def _fetch(self, host: str) -> RobotsRules:
+        """Fetch and parse the robots.txt of a host
+
+        :param host: The scheme and host to fetch robots.txt for
+        :type host: str
+        :return: The rules of the host
+        :rtype: :class:`levatas_indexer.scheduler.RobotsRules`
+        """
+        robots_url = f'{host}/robots.txt'
+        parser = RobotFileParser(robots_url)
+        logging.debug('Fetching robots.txt (%s)', robots_url)
+
+        try:
+            response = requests.get(robots_url,
+                                    headers={'User-Agent': self.user_agent},
+                                    timeout=ROBOTS_TIMEOUT)
+
+        except requests.RequestException:
+            logging.warning('Failed to fetch robots.txt (%s)', robots_url)
+            return RobotsRules(parser, allow_all=True)
+
+        if response.status_code in (401, 403):
+            return RobotsRules(parser, allow_all=False)
+
+        if response.status_code >= 400:
+            return RobotsRules(parser, allow_all=True)
+
+        parser.parse(response.text.splitlines())
+
+        return RobotsRules(parser)
+
+    def get(self, url: str) -> RobotsRules:
+        """Get the robots.txt rules for the host of a url
+
+        :param url: Any url on the host
+        :type url: str
+        :return: The rules of the host
+        :rtype: :class:`levatas_indexer.scheduler.RobotsRules`
+        """
+        host = get_host(url)
+
+        with self._lock:
+            cached = self._rules.get(host)
+
+        if cached is not None and self._clock() - cached[0] < self.max_age:
+            return cached[1]
+
+        rules = self._fetch(host)
+
+        with self._lock:
+            self._rules[host] = (self._clock(), rules)
+
+        return rules
+
+    def can_fetch(self, url: str) -> bool:
+        """Check if robots.txt allows a url to be fetched
+
+        :param url: The url to check
+        :type url: str
+        :return: Whether or not the url may be fetched
+        :rtype: bool
+        """
+        rules = self.get(url)
+
+        if rules.allow_all is not None:
+            return rules.allow_all
+
+        return rules.parser.can_fetch(self.user_agent, url)
+
+    def crawl_delay(self, url: str) -> Optional[float]:
+        """Get the crawl-delay robots.txt asks for on the host of a url
+
+        :param url: Any url on the host
+        :type url: str
+        :return: The number of seconds to wait between requests, or None if
+            no delay was given
+        :rtype: float, optional
+        """
+        rules = self.get(url)
+
+        if rules.allow_all is not None:
+            return None
+
+        delay = rules.parser.crawl_delay(self.user_agent)
+
+        if delay is None:
+            return None
+
+        return float(delay)
+
+
+# The pacing settings are kept so buckets can be made for new hosts
+class CrawlScheduler(utils.Frontier):  # pylint: disable=too-many-instance-attributes
+    """Frontier that paces requests to each host
+
+    :param rate: The starting number of requests per second for each host
+    :type rate: float
+    :param burst: How many requests can be made to a host back to back
+    :type burst: float
+    :param min_rate: The lowest rate a host will be slowed to
+    :type min_rate: float
+    :param max_rate: The highest rate a host will be sped up to
+    :type max_rate: float
+    :param slow_latency: Responses slower than this many seconds slow the
+        host down
+    :type slow_latency: float
+    :param robots: The robots.txt cache, or None to ignore robots.txt
+    :type robots: :class:`levatas_indexer.scheduler.RobotsCache`
+    :param max_wait: The longest Retry-After a throttled host is waited for
+    :type max_wait: float
+
+    Urls that are throttled are put back at the front of their host's queue
+    and retried up to MAX_ATTEMPTS times. Urls whose host asks for a longer
+    wait than max_wait are skipped instead.
+    """
+    # Each argument tunes a separate part of the pacing
+    def __init__(self,  # pylint: disable=too-many-arguments
+                 *,
+                 rate: float = 1.0,
+                 burst: float = 1.0,
+                 min_rate: float = 0.1,
+                 max_rate: float = 10.0,
+                 slow_latency: float = 2.0,
+                 robots: Optional[RobotsCache] = None,
+                 max_wait: float = MAX_RETRY_AFTER,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Optional[Callable[[float], None]] = None):
+        """Constructor method
+
+        :param rate: The starting number of requests per second for each host
+        :type rate: float, optional
+        :param burst: How many requests can be made to a host back to back
+        :type burst: float, optional
+        :param min_rate: The lowest rate a host will be slowed to
+        :type min_rate: float, optional
+        :param max_rate: The highest rate a host will be sped up to
+        :type max_rate: float, optional
+        :param slow_latency: Responses slower than this many seconds slow the
+            host down
+        :type slow_latency: float, optional
+        :param robots: The robots.txt cache, or None to ignore robots.txt
+        :type robots: :class:`levatas_indexer.scheduler.RobotsCache`, optional
+        :param max_wait: The longest Retry-After a throttled host is waited
+            for
+        :type max_wait: float, optional
+        :param clock: Function returning the current time in seconds
+        :type clock: Callable[[], float], optional
+        :param sleep: Function used to wait for a host to be ready. By
+            default the wait ends early when the scheduler is closed.
+        :type sleep: Callable[[float], None], optional
+        """
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.slow_latency = slow_latency
+        self.robots = robots
+        self.max_wait = max_wait
+        self._closed = threading.Event()
+        self._clock = clock
+        self._sleep = sleep if sleep is not None else self._closed.wait
+        self._queues: Dict[str, Deque[Tuple[str, int]]] = OrderedDict()
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._attempts: Dict[str, Tuple[int, int]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(queue) for queue in self._queues.values())
+
+    def _bucket(self, host: str) -> TokenBucket:
+        """Get the token bucket for a host, creating it if needed
+
+        :param host: The scheme and host
+        :type host: str
+        :return: The bucket for the host
+        :rtype: :class:`levatas_indexer.scheduler.TokenBucket`
+        """
+        if host not in self._buckets:
+            self._buckets[host] = TokenBucket(self.rate,
+                                              self.burst,
+                                              self.min_rate,
+                                              self.max_rate,
+                                              self._clock())
+
+        return self._buckets[host]
+
+    def push(self, url: str, depth: int) -> None:
+        """Add a url to the queue for its host
+
+        :param url: The url to fetch
+        :type url: str
+        :param depth: How deep to keep fetching documents from the url
+        :type depth: int
+        """
+        with self._lock:
+            self._queues.setdefault(get_host(url), deque()).append((url, depth))
+
+    def pop(self) -> Optional[Tuple[str, int]]:
+        """Remove the next url from the host that can be fetched soonest
+
+        This blocks until the host is ready, or the scheduler is closed. Hosts
+        that are equally ready are taken in turn.
+
+        :return: A tuple of the url and its depth, or None if the frontier is
+            empty or closed
+        :rtype: Tuple[str, int], optional
+        """
+        with self._lock:
+            if not self._queues or self._closed.is_set():
+                return None
+
+            now = self._clock()
+            host = min(self._queues, key=lambda host: self._bucket(host).delay(now))
+            wait = self._bucket(host).reserve(now)
+            queue = self._queues.pop(host)
+            item = queue.popleft()
+            depth, attempts = self._attempts.get(item[0], (item[1], 0))
+            self._attempts[item[0]] = (depth, attempts + 1)
+
+            if queue:
+                self._queues[host] = queue
+
+        if wait > 0:
+            logging.debug('Waiting %.2f seconds for %s', wait, host)
+            self._sleep(wait)
+
+        if self._closed.is_set():
+            with self._lock:
+                self._queues.setdefault(host, deque()).appendleft(item)
+
+            return None
+
+        return item
+
+    def close(self) -> None:
+        self._closed.set()
+
+    def pending(self) -> List[Tuple[str, int]]:
+        """Get a copy of the urls waiting to be fetched
+
+        :return: A list of tuples of the url and its depth
+        :rtype: List[Tuple[str, int]]
+        """
+        with self._lock:
+            return [item for queue in self._queues.values() for item in queue]
+
+    def allowed(self, url: str) -> bool:
+        """Check robots.txt for a url, applying the host's crawl-delay
+
+        :param url: The url to check
+        :type url: str
+        :return: Whether or not the url may be fetched
+        :rtype: bool
+        """
+        if self.robots is None:
+            return True
+
+        delay = self.robots.crawl_delay(url)
+
+        if delay:
+            with self._lock:
+                self._bucket(get_host(url)).limit(1 / delay)
+
+        if self.robots.can_fetch(url):
+            return True
+
+        with self._lock:
+            self._attempts.pop(url, None)
+
+        return False
+
+    def record(self, result: utils.FetchResult) -> None:
+        """Adapt the rate of a host to how it responded
+
+        Throttling responses block the host for the time given by Retry-After
+        and halve its rate. Slow responses reduce the rate, and fast
+        responses raise it.
+
+        :param result: The result of the fetch
+        :type result: :class:`levatas_indexer.utils.FetchResult`
+        """
+        host = get_host(result.url)
+
+        with self._lock:
+            bucket = self._bucket(host)
+            depth, attempts = self._attempts.pop(result.url, (0, MAX_ATTEMPTS))
+
+            if result.status in THROTTLE_STATUSES:
+                retry_after = parse_retry_after(result.headers.get('Retry-After'))
+
+                if retry_after is None:
+                    retry_after = 1 / bucket.rate
+
+                bucket.slow_down(0.5)
+                bucket.block(self._clock(), min(retry_after, self.max_wait))
+
+                if attempts < MAX_ATTEMPTS and retry_after <= self.max_wait:
+                    self._attempts[result.url] = (depth, attempts)
+                    self._queues.setdefault(host, deque()).appendleft((result.url, depth))
+                logging.info('Throttled by %s (status: %d, rate: %.2f, retry after: %.2f)',
+                             host, result.status, bucket.rate, retry_after)
+
+            elif result.elapsed > self.slow_latency:
+                bucket.slow_down(0.5)
+
+            else:
+                bucket.speed_up(self.rate / 2)
@@ -6,31 +6,185 @@ importing from other internal modules. These utilites are inteded to be
 used throughout the application, and importing from other internal modules
 is likely to create circular references.
 """
-from typing import Iterator, List
+from typing import ContextManager, Deque, Iterator, List, Mapping, NamedTuple, Optional, Tuple
+import codecs
+import collections
+import contextlib
 import logging
+import posixpath
+import threading
+import time
 import urllib.parse
 
 from bs4 import BeautifulSoup  # type: ignore
 import requests
 import validators  # type: ignore
 
+USER_AGENT = 'levatas-indexer'
+MAX_PAGE_SIZE = 5 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+FETCH_TIMEOUT = 30
+HTML_CONTENT_TYPES = frozenset({'text/html', 'application/xhtml+xml'})
+SKIPPED_EXTENSIONS = frozenset({
+    '.7z', '.avi', '.bmp', '.bz2', '.css', '.csv', '.dmg', '.doc', '.docx',
+    '.eot', '.epub', '.exe', '.flac', '.gif', '.gz', '.ico', '.iso', '.jpeg',
+    '.jpg', '.js', '.json', '.m4a', '.m4v', '.mkv', '.mov', '.mp3', '.mp4',
+    '.mpeg', '.mpg', '.msi', '.odt', '.ogg', '.otf', '.pdf', '.png', '.ppt',
+    '.pptx', '.rar', '.rss', '.svg', '.tar', '.tgz', '.tif', '.tiff', '.ttf',
+    '.wav', '.webm', '.webp', '.wmv', '.woff', '.woff2', '.xls', '.xlsx',
+    '.xz', '.zip'
+})
+
+
+def is_html_content_type(content_type: str) -> bool:
+    """Check if a Content-Type header describes an html document
+
+    A missing content type is treated as html, since plenty of servers don't
+    bother sending one.
+
+    :param content_type: The value of the Content-Type header
+    :type content_type: str
+    :return: Whether or not the content type is html
+    :rtype: bool
+    """
+    media_type = content_type.split(';', 1)[0].strip().lower()
+
+    return not media_type or media_type in HTML_CONTENT_TYPES
+
+
+def has_skipped_extension(url: str) -> bool:
+    """Check if a url points at a file type that is never worth fetching
+
+    :param url: The url to check
+    :type url: str
+    :return: Whether or not the url should be skipped
+    :rtype: bool
+    """
+    path = urllib.parse.urlparse(url).path
+    extension = posixpath.splitext(path)[1].lower()
+
+    return extension in SKIPPED_EXTENSIONS
+
+
+def read_text(response: requests.Response, max_size: int) -> Optional[str]:
+    """Incrementally read and decode the body of a streamed response
+
+    :param response: A response created with ``stream=True``
+    :type response: :class:`requests.Response`
+    :param max_size: The maximum number of bytes to read
+    :type max_size: int
+    :return: The decoded body, or None if the body is larger than max_size
+    :rtype: str, optional
+    """
+    try:
+        decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')(errors='replace')
+
+    except LookupError:
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+    parts = []
+    size = 0
+
+    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+        size += len(chunk)
+
+        if size > max_size:
+            return None
+
+        parts.append(decoder.decode(chunk))
+
+    parts.append(decoder.decode(b'', final=True))
+
+    return ''.join(parts)
+
+
+class FetchResult(NamedTuple):
+    """The outcome of fetching a single page
+
+    :param url: The url that was fetched
+    :type url: str
+    :param status: The http status code of the response
+    :type status: int
+    :param headers: The headers of the response
+    :type headers: Mapping[str, str]
+    :param text: The body of the page, or an empty string if the page could
+        not be used
+    :type text: str
+    :param elapsed: How long the request took in seconds
+    :type elapsed: float
+    """
+    url: str
+    status: int
+    headers: Mapping[str, str]
+    text: str
+    elapsed: float
 
-def fetch_page(url: str) -> str:
-    """Fetch a webpage from a url
+
+def fetch_response(url: str, max_size: int = MAX_PAGE_SIZE) -> FetchResult:
+    """Fetch a webpage from a url, keeping the details of the response
+
+    The response is streamed so that the headers can be checked before the
+    body is downloaded. Resources that are not html, or that are larger than
+    max_size, are abandoned and the text of the result is left empty.
 
     :param url: The url used to fetch the page
     :type url: str
-    :return: The page that was fetched
-    :rtype: str
+    :param max_size: The maximum size of the page in bytes
+    :type max_size: int, optional
+    :return: The result of the request
+    :rtype: :class:`levatas_indexer.utils.FetchResult`
     """
     logging.debug('Fetching page for url: %s', url)
-    response = requests.get(url)
+    start = time.monotonic()
+    response = requests.get(url,
+                            headers={'User-Agent': USER_AGENT},
+                            stream=True,
+                            timeout=FETCH_TIMEOUT)
 
-    if response.status_code != 200:
-        logging.warning('Failed to fetch page (url: %s, status: %d).', url, response.status_code)
-        return ''
+    try:
+        text = ''
+
+        if response.status_code != 200:
+            logging.warning('Failed to fetch page (url: %s, status: %d).',
+                            url, response.status_code)
+
+        elif not is_html_content_type(response.headers.get('Content-Type', '')):
+            logging.info('Skipping non html page (url: %s, content type: %s).',
+                         url, response.headers.get('Content-Type'))
+
+        elif response.headers.get('Content-Length', '').isdigit() \
+                and int(response.headers['Content-Length']) > max_size:
+            logging.info('Skipping oversized page (url: %s, size: %s).',
+                         url, response.headers['Content-Length'])
 
-    return response.text
+        else:
+            body = read_text(response, max_size)
+
+            if body is None:
+                logging.info('Abandoned oversized page (url: %s, max size: %d).', url, max_size)
+
+            else:
+                text = body
+
+        return FetchResult(url, response.status_code, response.headers, text,
+                           time.monotonic() - start)
+
+    finally:
+        response.close()
+
+
+def fetch_page(url: str, max_size: int = MAX_PAGE_SIZE) -> str:
+    """Fetch a webpage from a url
+
+    :param url: The url used to fetch the page
+    :type url: str
+    :param max_size: The maximum size of the page in bytes
+    :type max_size: int, optional
+    :return: The page that was fetched, or an empty string if the page was
+        not html, too large, or returned an error
+    :rtype: str
+    """
+    return fetch_response(url, max_size=max_size).text
 
 
 def parse_html(html_doc: str) -> BeautifulSoup:
@@ -92,13 +246,217 @@ def sanitize_href(host_url: str, href: str) -> str:
     return url
 
 
-def fetch_documents(url: str, visted: set, depth: int = 1) -> Iterator[str]:
-    """A generator that recursively fetches web pages by URL
+def extract_links(url: str, html_doc: str) -> List[str]:
+    """Extract the crawlable hyperlinks from an html document
 
-    Recursivel fetch documents based on a root url and any hyperlinks
-    imbedded in the page. How deep to fetch documents is controlled by the
-    depth parameter.  For example a depth of 1 will fetch the page specified
-    by the url, and the pages of any embedded hyperlinks.
+    Links that can't be sanitized, or that point at resources that are never
+    html, are dropped.
+
+    :param url: The url of the document
+    :type url: str
+    :param html_doc: The html document to search
+    :type html_doc: str
+    :return: A list of urls
+    :rtype: List[str]
+    """
+    links = []
+
+    for link in get_links(parse_html(html_doc)):
+        try:
+            link = sanitize_href(url, link)
+
+        except ValueError:
+            logging.warning('Failed to sanitize URL (skipping %s)', link)
+            continue
+
+        if has_skipped_extension(link):
+            logging.debug('Skipping link to non html resource (%s)', link)
+            continue
+
+        links.append(link)
+
+    return links
+
+
+class Frontier:
+    """First in first out queue of urls waiting to be fetched
+
+    A frontier decides which url is crawled next. Subclasses can override
+    :meth:`pop` to change the order urls are fetched in, :meth:`allowed` to
+    skip urls entirely, and :meth:`record` to react to the result of a fetch.
+    Frontiers are safe to share between threads.
+    """
+    def __init__(self):
+        """Constructor method"""
+        self._pending: Deque[Tuple[str, int]] = collections.deque()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def push(self, url: str, depth: int) -> None:
+        """Add a url to the frontier
+
+        :param url: The url to fetch
+        :type url: str
+        :param depth: How deep to keep fetching documents from the url
+        :type depth: int
+        """
+        with self._lock:
+            self._pending.append((url, depth))
+
+    def pop(self) -> Optional[Tuple[str, int]]:
+        """Remove the next url to fetch from the frontier
+
+        :return: A tuple of the url and its depth, or None if the frontier is
+            empty
+        :rtype: Tuple[str, int], optional
+        """
+        with self._lock:
+            if not self._pending:
+                return None
+
+            return self._pending.popleft()
+
+    def pending(self) -> List[Tuple[str, int]]:
+        """Get a copy of the urls waiting to be fetched
+
+        :return: A list of tuples of the url and its depth
+        :rtype: List[Tuple[str, int]]
+        """
+        with self._lock:
+            return list(self._pending)
+
+    def close(self) -> None:
+        """Wake any threads waiting in :meth:`pop` because the crawl is
+        stopping"""
+
+    def allowed(self, url: str) -> bool:  # pylint: disable=unused-argument
+        """Check if a url may be fetched
+
+        :param url: The url to check
+        :type url: str
+        :return: Whether or not the url may be fetched
+        :rtype: bool
+        """
+        return True
+
+    def record(self, result: FetchResult) -> None:
+        """Called with the result of every fetch
+
+        Frontiers may push the url of a failed fetch again to retry it.
+
+        :param result: The result of the fetch
+        :type result: :class:`levatas_indexer.utils.FetchResult`
+        """
+
+
+# The visited set and its lock are shared by every page of the crawl
+def visit_page(url: str,  # pylint: disable=too-many-arguments
+               depth: int,
+               visted: set,
+               frontier: Frontier,
+               *,
+               max_size: int = MAX_PAGE_SIZE,
+               lock: Optional[ContextManager] = None) -> Optional[str]:
+    """Fetch a url taken from a frontier and queue the links of the page
+
+    :param url: The url to fetch
+    :type url: str
+    :param depth: How deep to keep fetching documents from the url
+    :type depth: int
+    :param visted: A set for tracking urls that have already been visted
+    :type visted: set
+    :param frontier: The frontier to queue links on
+    :type frontier: :class:`levatas_indexer.utils.Frontier`
+    :param max_size: The maximum size of a page in bytes
+    :type max_size: int, optional
+    :param lock: A lock to hold while the visited set is updated, for when
+        pages are visited from several threads
+    :type lock: ContextManager, optional
+    :return: The text of the page, or None if the frontier doesn't allow the
+        url to be fetched. Pages that can't be reached are empty.
+    :rtype: str, optional
+    """
+    if not frontier.allowed(url):
+        logging.info('Skipping disallowed url (%s)', url)
+        return None
+
+    try:
+        result = fetch_response(url, max_size=max_size)
+
+    except requests.RequestException as error:
+        logging.warning('Failed to fetch page (url: %s, error: %s).', url, error)
+        return ''
+
+    frontier.record(result)
+
+    if depth > 0 and result.text:
+        links = extract_links(url, result.text)
+
+        with lock or contextlib.nullcontext():
+            links = [link for link in dict.fromkeys(links) if link not in visted]
+            visted.update(links)
+
+        for link in links:
+            frontier.push(link, depth - 1)
+
+    return result.text
+
+
+def crawl_pages(url: str,
+                visted: set,
+                depth: int = 1,
+                max_size: int = MAX_PAGE_SIZE,
+                frontier: Optional[Frontier] = None) -> Iterator[Tuple[str, str]]:
+    """A generator that fetches web pages breadth first from a frontier
+
+    Urls are added to the visted set as soon as they are added to the
+    frontier, so every url is queued at most once. The links of a page are
+    added to the frontier before the page is yielded, so the frontier and the
+    visited set always describe everything left to crawl once a page has been
+    handed to the caller.
+
+    :param url: The root url to fetch
+    :type url: str
+    :param visted: A set for tracking urls that have already been visted
+    :type visted: set
+    :param depth: How deep to fetch documents.
+    :type depth: int
+    :param max_size: The maximum size of a page in bytes
+    :type max_size: int
+    :param frontier: The frontier to crawl from (default=Frontier()).
+    :type frontier: :class:`levatas_indexer.utils.Frontier`, optional
+    :return: An iterator of tuples of the url and text of the web pages
+    :rtype: Iterator[Tuple[str, str]]
+    """
+    if frontier is None:
+        frontier = Frontier()
+
+    if url not in visted:
+        visted.add(url)
+        frontier.push(url, depth)
+
+    while (item := frontier.pop()) is not None:
+        url, depth = item
+        text = visit_page(url, depth, visted, frontier, max_size=max_size)
+
+        if text is not None:
+            yield url, text
+
+
+def fetch_documents(url: str,
+                    visted: set,
+                    depth: int = 1,
+                    max_size: int = MAX_PAGE_SIZE,
+                    frontier: Optional[Frontier] = None) -> Iterator[str]:
+    """A generator that fetches web pages by URL
+
+    Fetch documents based on a root url and any hyperlinks imbedded in the
+    page. How deep to fetch documents is controlled by the depth parameter.
+    For example a depth of 1 will fetch the page specified by the url, and
+    the pages of any embedded hyperlinks.
 
     NOTE: More effort should be spent on checking if a url has already been
     visted. For example this method will retrieve the html documents for both
@@ -112,29 +470,12 @@ def fetch_documents(url: str, visted: set, depth: int = 1) -> Iterator[str]:
     :type visted: set
     :param depth: How keep to recursively fetch documents.
     :type depth: int
+    :param max_size: The maximum size of a page in bytes
+    :type max_size: int
+    :param frontier: The frontier to crawl from (default=Frontier()).
+    :type frontier: :class:`levatas_indexer.utils.Frontier`, optional
     :return: An iterator to iterate of the text of the web pages
     :rtype: Iterator[str]
     """
-
-    text = fetch_page(url)
-    visted.add(url)
-
-    yield text
-
-    if depth > 0:
-        soup = parse_html(text)
-        links = get_links(soup)
-
-        for link in links:
-            try:
-                link = sanitize_href(url, link)
-
-            except ValueError:
-                logging.warning('Failed to sanitize URL (skipping %s)', link)
-                continue
-
-            if link in visted:
-                continue
-
-            new_depth = depth -1
-            yield from fetch_documents(link, visted, depth=new_depth)
+    for _, text in crawl_pages(url, visted, depth=depth, max_size=max_size, frontier=frontier):
+        yield text
@@ -1,5 +1,63 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import pathlib
 import sys
+import threading
+
+import pytest
 
 PATH = pathlib.Path(__file__).parent.parent.parent.resolve()
 sys.path.insert(0, str(PATH))
+
+
+class LocalSite:
+    """A stand-in web site served from a dictionary of paths
+
+    Each route is either a body, or a list of (status, headers, body) tuples
+    that are served in turn, repeating the last one once they run out.
+    """
+    def __init__(self, routes):
+        self.routes = routes
+        self.requests = []
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+
+    def _handler(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                site.requests.append(self.path)
+                route = site.routes.get(self.path, [(404, {}, 'Not Found')])
+
+                if isinstance(route, str):
+                    route = [(200, {'Content-Type': 'text/html'}, route)]
+
+                attempt = min(site.requests.count(self.path), len(route)) - 1
+                status, headers, body = route[attempt]
+                encoded = body.encode('utf-8')
+
+                self.send_response(status)
+
+                for name, value in headers.items():
+                    self.send_header(name, value)
+
+                self.send_header('Content-Length', str(len(encoded)))
+                self.end_headers()
+                self.wfile.write(encoded)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+@pytest.fixture(scope='function')
+def local_site():
+    site = LocalSite({})
+    thread = threading.Thread(target=site.server.serve_forever, daemon=True)
+    thread.start()
+
+    yield site
+
+    site.server.shutdown()
+    site.server.server_close()
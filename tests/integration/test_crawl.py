@@ -0,0 +1,147 @@
+import functools
+import threading
+
+from werkzeug.serving import make_server
+import pytest
+
+from levatas_indexer import distributed, indexer, routes, scheduler
+from levatas_indexer.application import app
+
+HTML = {'Content-Type': 'text/html'}
+TOKEN = 'secret'
+
+
+def test_polite_crawl(local_site):
+    local_site.routes.update({
+        '/robots.txt': [(200, {}, 'User-agent: *\nDisallow: /private\n')],
+        '/': '<a href="/one">one</a> <a href="/busy">busy</a> '
+             '<a href="/private">private</a> <a href="/report.pdf">report</a> '
+             '<a href="/image">image</a> root',
+        '/one': 'apple banana',
+        '/busy': [(429, {'Retry-After': '0'}, ''), (200, HTML, 'cherry')],
+        '/private': 'secret',
+        '/image': [(200, {'Content-Type': 'image/png'}, 'image data')]
+    })
+    crawl_scheduler = scheduler.CrawlScheduler(rate=50.0, robots=scheduler.RobotsCache())
+    word_indexer = indexer.WordIndexer(indexer.Tokenizer())
+
+    result = indexer.index_html_documents(f'{local_site.url}/', word_indexer, frontier=crawl_scheduler)
+
+    assert result['apple'] == 1
+    assert result['cherry'] == 1
+    assert 'secret' not in result
+    assert 'data' not in result
+    assert local_site.requests.count('/robots.txt') == 1
+    assert local_site.requests.count('/busy') == 2
+    assert '/private' not in local_site.requests
+    assert '/report.pdf' not in local_site.requests
+
+
+SITE = {
+    '/': '<a href="/one">one</a> <a href="/two">two</a> <a href="/three">three</a> root',
+    '/one': '<p>apple banana</p> <a href="/two">two</a>',
+    '/two': '<p>banana cherry</p> <a href="/four">four</a>',
+    '/three': '<p>cherry apple apple</p>'
+}
+
+
+@pytest.fixture(scope='function')
+def queue_app(monkeypatch, tmp_path):
+    monkeypatch.setitem(app.config, 'QUEUE_TOKEN', TOKEN)
+    monkeypatch.setattr(routes.distributed, 'SQLiteWorkQueue',
+                        functools.partial(distributed.SQLiteWorkQueue,
+                                          path=str(tmp_path.joinpath('queue.sqlite3'))))
+    return app
+
+
+@pytest.fixture(scope='function')
+def queue_server(queue_app):
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield f'http://127.0.0.1:{server.server_port}'
+
+    server.shutdown()
+
+
+def test_remote_workers_match_single_process_crawl(local_site, queue_server):
+    local_site.routes.update(SITE)
+    expected = indexer.index_html_documents(f'{local_site.url}/',
+                                            indexer.WordIndexer(indexer.Tokenizer()))
+
+    work_queue = distributed.open_queue(queue_server, 'job-1', TOKEN)
+    work_queue.push(f'{local_site.url}/', 1)
+    threads = [
+        threading.Thread(target=distributed.run_worker,
+                         args=(distributed.open_queue(queue_server, 'job-1', TOKEN),
+                               indexer.WordIndexer(indexer.Tokenizer()),
+                               f'worker-{i}'),
+                         kwargs={'options': distributed.WorkerOptions(batch_size=2,
+                                                                      poll_interval=0.01)})
+        for i in range(3)
+    ]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    word_indexer = indexer.WordIndexer(indexer.Tokenizer())
+    word_indexer.merge(work_queue.counts())
+
+    assert work_queue.finished() is True
+    assert word_indexer.index == expected
+    assert local_site.requests.count('/two') == 2
+
+
+def test_queue_routes_need_a_configured_token(queue_app, monkeypatch):
+    test_client = queue_app.test_client()
+
+    assert test_client.post('/queue/job-1/status', json={}).status_code == 401
+
+    monkeypatch.setitem(app.config, 'QUEUE_TOKEN', None)
+    headers = {'Authorization': f'Bearer {TOKEN}'}
+
+    assert test_client.post('/queue/job-1/status', json={}, headers=headers).status_code == 404
+
+
+def test_queue_routes_reject_unknown_actions(queue_app):
+    response = queue_app.test_client().post('/queue/job-1/delete',
+                                            json={},
+                                            headers={'Authorization': f'Bearer {TOKEN}'})
+
+    assert response.status_code == 404
+
+
+@pytest.mark.parametrize('action, body', [
+    ('push', {'items': [['file:///etc/passwd', 0]]}),
+    ('push', {'items': [['https://google.com', -1]]}),
+    ('claim', {}),
+    ('claim', {'worker': 'worker-1', 'lease': 'long'}),
+    ('complete', {'worker': 'worker-1', 'results': [['https://google.com', 0, {'one': 1}]]}),
+    ('status', ['not', 'an', 'object'])
+])
+def test_queue_routes_reject_malformed_bodies(queue_app, action, body):
+    response = queue_app.test_client().post(f'/queue/job-1/{action}',
+                                            json=body,
+                                            headers={'Authorization': f'Bearer {TOKEN}'})
+
+    assert response.status_code == 400
+
+
+def test_crawl_with_worker_processes(local_site, tmp_path):
+    local_site.routes.update(SITE)
+    expected = indexer.index_html_documents(f'{local_site.url}/', indexer.get_default_indexer())
+
+    result = distributed.crawl(f'{local_site.url}/',
+                               str(tmp_path.joinpath('queue.sqlite3')),
+                               'job-1',
+                               indexer.get_default_indexer(),
+                               workers=2,
+                               options=distributed.WorkerOptions(rate=50.0,
+                                                                 respect_robots=False,
+                                                                 poll_interval=0.05))
+
+    assert result == expected
@@ -1,7 +1,9 @@
+import functools
 import json
 
 import pytest
 
+from levatas_indexer import checkpoint, routes
 from levatas_indexer.application import app
 
 
@@ -40,3 +42,104 @@ def test_index_url_with_invalid_url(test_client):
     response = test_client.get('/index', query_string=query_string)
 
     assert response.status_code == 400
+
+
+def test_index_url_with_unreachable_url(test_client):
+    query_string = {'url': 'http://127.0.0.1:1/'}
+    response = test_client.get('/index', query_string=query_string)
+
+    assert response.status_code == 200
+    assert json.loads(response.data.decode()) == {}
+
+
+def test_index_url_with_words(test_client, local_site):
+    local_site.routes['/'] = '<p>Running runs run</p>'
+    query_string = {'url': f'{local_site.url}/', 'word': ['Running', 'walk']}
+    response = test_client.get('/index', query_string=query_string)
+
+    assert response.status_code == 200
+    assert json.loads(response.data.decode()) == {'Running': 3, 'walk': 0}
+
+
+def test_index_url_with_words_in_body(test_client, local_site):
+    local_site.routes['/'] = '<p>Running runs run</p>'
+    body = {'url': f'{local_site.url}/', 'words': ['run', 'walk']}
+    response = test_client.post('/index', json=body)
+
+    assert response.status_code == 200
+    assert json.loads(response.data.decode()) == {'run': 3, 'walk': 0}
+
+
+def test_index_url_with_invalid_words(test_client):
+    body = {'url': 'http://google.com', 'words': 'run'}
+    response = test_client.post('/index', json=body)
+
+    assert response.status_code == 400
+
+
+def test_index_url_with_non_object_body(test_client):
+    response = test_client.post('/index', json=['run'])
+
+    assert response.status_code == 400
+
+
+def test_index_url_with_phrases(test_client, local_site):
+    local_site.routes['/'] = '<p>New York is in New York</p>'
+    query_string = {'url': f'{local_site.url}/', 'word': ['new york', 'york is'], 'ngrams': 2}
+    response = test_client.get('/index', query_string=query_string)
+
+    assert response.status_code == 200
+    assert json.loads(response.data.decode()) == {'new york': 2, 'york is': 1}
+
+
+def test_index_url_with_min_phrase_count(test_client, local_site):
+    local_site.routes['/'] = '<p>New York is in New York</p>'
+    query_string = {'url': f'{local_site.url}/', 'ngrams': 2, 'min_phrase_count': 2}
+    response = test_client.get('/index', query_string=query_string)
+
+    assert response.status_code == 200
+
+    result = json.loads(response.data.decode())
+
+    assert result['new york'] == 2
+    assert 'york is' not in result
+    assert result['new'] == 2
+
+
+def test_index_url_with_invalid_min_phrase_count(test_client):
+    query_string = {'url': 'http://google.com', 'min_phrase_count': '0'}
+    response = test_client.get('/index', query_string=query_string)
+
+    assert response.status_code == 400
+
+
+def test_index_url_with_invalid_ngrams(test_client):
+    query_string = {'url': 'http://google.com', 'ngrams': 'lots'}
+    response = test_client.get('/index', query_string=query_string)
+
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('body', [
+    {'url': 'http://google.com', 'job': ['x']},
+    {'job': {'id': 'x'}},
+    {'url': ['http://google.com']},
+    {'url': 'http://google.com', 'ngrams': True},
+    {'url': 'http://google.com', 'ngrams': 2.5}
+])
+def test_index_url_with_malformed_body(test_client, body):
+    response = test_client.post('/index', json=body)
+
+    assert response.status_code == 400
+
+
+def test_index_url_with_job_held_by_another_request(test_client, local_site, monkeypatch, tmp_path):
+    path = str(tmp_path.joinpath('checkpoints.sqlite3'))
+    monkeypatch.setattr(routes.checkpoint, 'Checkpoint',
+                        functools.partial(checkpoint.Checkpoint, path=path))
+    checkpoint.Checkpoint('job-1', path=path).acquire(f'{local_site.url}/')
+    query_string = {'url': f'{local_site.url}/', 'job': 'job-1'}
+    response = test_client.get('/index', query_string=query_string)
+
+    assert response.status_code == 409
+    assert local_site.requests == []
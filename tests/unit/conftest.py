@@ -1,5 +1,60 @@
+from unittest.mock import Mock
 import pathlib
 import sys
 
+import pytest
+
 PATH = pathlib.Path(__file__).parent.parent.parent.resolve()
 sys.path.insert(0, str(PATH))
+
+from levatas_indexer import indexer, utils
+
+
+class FakeClock:
+    """A clock that only moves when a test moves it"""
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture(scope='function')
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture(scope='function')
+def pages():
+    """A site whose root links to 20 pages, each linking to the next"""
+    return {
+        'https://google.com': ' '.join(f'<a href="/{i}">{i}</a>' for i in range(20)) + ' root',
+        **{f'https://google.com/{i}': f'page {i} <a href="/{i + 1}">next</a> shared words'
+           for i in range(21)}
+    }
+
+
+@pytest.fixture(scope='function')
+def fetch_response(pages):
+    def fetch_response(url, max_size=utils.MAX_PAGE_SIZE):
+        return utils.FetchResult(url, 200, {}, pages.get(url, ''), 0.01)
+
+    return fetch_response
+
+
+@pytest.fixture(scope='function')
+def mock_fetch(monkeypatch, fetch_response):
+    mock_fetch = Mock(side_effect=fetch_response)
+    monkeypatch.setattr(utils, 'fetch_response', mock_fetch)
+    return mock_fetch
+
+
+@pytest.fixture(scope='function')
+def make_indexer():
+    def make_indexer(ngram_size=1):
+        return indexer.WordIndexer(indexer.Tokenizer(), ngram_size=ngram_size)
+
+    return make_indexer
@@ -0,0 +1,85 @@
+import pytest
+
+from levatas_indexer import checkpoint
+
+
+class TestCheckpoint:
+
+    @pytest.fixture(scope='function')
+    def job_checkpoint(self, tmp_path):
+        return checkpoint.Checkpoint('job-1', path=str(tmp_path.joinpath('checkpoints.sqlite3')))
+
+    def test_missing_job(self, job_checkpoint):
+        assert job_checkpoint.exists() is False
+        assert job_checkpoint.load() is None
+
+    def test_save_and_load(self, job_checkpoint):
+        job_checkpoint.save('https://google.com',
+                            [('https://google.com/b', 0), ('https://google.com/a', 1)],
+                            {'https://google.com', 'https://google.com/a', 'https://google.com/b'},
+                            {'one': 2, 'two': 1},
+                            phrases={('one', 'two'): 1},
+                            fingerprints=[('abc', 2 ** 64 - 1)],
+                            skipped=3)
+
+        state = job_checkpoint.load()
+
+        assert job_checkpoint.exists() is True
+        assert state.url == 'https://google.com'
+        assert state.complete is False
+        assert state.pending == [('https://google.com/b', 0), ('https://google.com/a', 1)]
+        assert state.visited == {'https://google.com', 'https://google.com/a', 'https://google.com/b'}
+        assert state.counts == {'one': 2, 'two': 1}
+        assert state.phrases == {('one', 'two'): 1}
+        assert state.fingerprints == [('abc', 2 ** 64 - 1)]
+        assert state.skipped == 3
+
+    def test_save_adds_to_previous_progress(self, job_checkpoint):
+        job_checkpoint.save('https://google.com', [('https://google.com/a', 0)],
+                            ['https://google.com', 'https://google.com/a'], {'one': 1},
+                            phrases={('one', 'two'): 1}, fingerprints=[('abc', 1)], skipped=1)
+        job_checkpoint.save('https://google.com', [], ['https://google.com/b'],
+                            {'one': 2, 'two': 1}, phrases={('one', 'two'): 2},
+                            fingerprints=[('def', 2)], skipped=2, complete=True)
+
+        state = job_checkpoint.load()
+
+        assert state.pending == []
+        assert state.visited == {'https://google.com', 'https://google.com/a', 'https://google.com/b'}
+        assert state.counts == {'one': 3, 'two': 1}
+        assert state.phrases == {('one', 'two'): 3}
+        assert state.fingerprints == [('abc', 1), ('def', 2)]
+        assert state.skipped == 2
+        assert state.complete is True
+
+    def test_jobs_are_independent(self, job_checkpoint):
+        other = checkpoint.Checkpoint('job-2', path=job_checkpoint.path)
+        job_checkpoint.save('https://google.com', [], set(), {'one': 1})
+        other.save('https://example.com', [], set(), {'two': 1})
+
+        job_checkpoint.delete()
+
+        assert job_checkpoint.exists() is False
+        assert other.load().counts == {'two': 1}
+
+    def test_only_one_run_holds_a_job(self, job_checkpoint):
+        other = checkpoint.Checkpoint('job-1', path=job_checkpoint.path)
+
+        assert job_checkpoint.acquire('https://google.com') is True
+        assert other.acquire('https://google.com') is False
+
+        job_checkpoint.save('https://google.com', [], set(), {'one': 1})
+
+        assert other.acquire('https://google.com') is False
+
+        job_checkpoint.release()
+
+        assert other.acquire('https://google.com') is True
+        assert other.load().counts == {'one': 1}
+
+    def test_stale_hold_is_taken_over(self, job_checkpoint, monkeypatch):
+        other = checkpoint.Checkpoint('job-1', path=job_checkpoint.path)
+        job_checkpoint.acquire('https://google.com')
+        monkeypatch.setattr(checkpoint, 'LOCK_TIMEOUT', -1.0)
+
+        assert other.acquire('https://google.com') is True
@@ -0,0 +1,121 @@
+import pytest
+
+from levatas_indexer import dedup
+
+DOCUMENT = ' '.join(
+    f'word{i} appears in sentence number {i % 7} of the sample page'
+    for i in range(50)
+)
+
+
+class TestNormalizeWords:
+
+    def test_markup_is_ignored(self):
+        result = dedup.normalize_words('<div class="a">Some <b>Text</b></div>')
+
+        assert result == ['some', 'text']
+
+    def test_scripts_styles_and_comments_are_ignored(self):
+        result = dedup.normalize_words('<SCRIPT type="text/javascript">var a = 1;</SCRIPT>'
+                                       '<style>p { color: red }</style><!-- a comment -->'
+                                       '<noscript>Enable scripts</noscript><p>Some text</p>')
+
+        assert result == ['some', 'text']
+
+
+class TestSimhash:
+
+    def test_identical_documents_match(self):
+        words = dedup.normalize_words(DOCUMENT)
+
+        assert dedup.simhash(words) == dedup.simhash(list(words))
+
+    def test_similar_documents_are_close(self):
+        words = dedup.normalize_words(DOCUMENT)
+        changed = dedup.normalize_words(DOCUMENT + ' printed on tuesday')
+
+        distance = dedup.hamming_distance(dedup.simhash(words), dedup.simhash(changed))
+
+        assert distance <= 3
+
+    def test_different_documents_are_far(self):
+        words = dedup.normalize_words(DOCUMENT)
+        other = dedup.normalize_words(' '.join(f'other{i} content' for i in range(100)))
+
+        distance = dedup.hamming_distance(dedup.simhash(words), dedup.simhash(other))
+
+        assert distance > 3
+
+    def test_short_documents(self):
+        assert isinstance(dedup.simhash(['one']), int)
+
+
+class TestHammingDistance:
+
+    @pytest.mark.parametrize('first,second,expected', [
+        (0, 0, 0),
+        (0b1010, 0b1010, 0),
+        (0b1010, 0b0101, 4),
+        (1 << 63, 0, 1)
+    ])
+    def test_distance(self, first, second, expected):
+        assert dedup.hamming_distance(first, second) == expected
+
+
+class TestDuplicateFilter:
+
+    @pytest.fixture(scope='function')
+    def duplicate_filter(self):
+        return dedup.DuplicateFilter()
+
+    def test_first_document_is_accepted(self, duplicate_filter):
+        assert duplicate_filter.is_duplicate(DOCUMENT) is False
+        assert duplicate_filter.skipped == 0
+
+    def test_exact_duplicate_is_skipped(self, duplicate_filter):
+        duplicate_filter.is_duplicate(DOCUMENT)
+
+        assert duplicate_filter.is_duplicate(f'<html>{DOCUMENT}</html>') is True
+        assert duplicate_filter.skipped == 1
+
+    def test_near_duplicate_is_skipped(self, duplicate_filter):
+        duplicate_filter.is_duplicate(DOCUMENT)
+
+        assert duplicate_filter.is_duplicate(DOCUMENT + ' printed on tuesday') is True
+        assert duplicate_filter.skipped == 1
+
+    def test_different_document_is_accepted(self, duplicate_filter):
+        duplicate_filter.is_duplicate(DOCUMENT)
+        other = ' '.join(f'other{i} content' for i in range(100))
+
+        assert duplicate_filter.is_duplicate(other) is False
+        assert len(duplicate_filter.fingerprints) == 2
+
+    def test_pages_sharing_a_script_are_not_duplicates(self, duplicate_filter):
+        script = '<script>' + ' '.join(f'var v{i} = f{i}();' for i in range(2000)) + '</script>'
+        pages = [
+            f'<html><head>{script}</head><body>'
+            + ' '.join(f'page{page} word{i} of topic {page * i % 13}' for i in range(50))
+            + '</body></html>'
+            for page in range(6)
+        ]
+
+        assert [duplicate_filter.is_duplicate(page) for page in pages] == [False] * 6
+
+    def test_empty_documents_are_not_duplicates(self, duplicate_filter):
+        assert duplicate_filter.is_duplicate('') is False
+        assert duplicate_filter.is_duplicate('') is False
+        assert duplicate_filter.skipped == 0
+
+    def test_add_restores_fingerprints(self, duplicate_filter):
+        duplicate_filter.is_duplicate(DOCUMENT)
+        restored = dedup.DuplicateFilter()
+
+        for digest, fingerprint in duplicate_filter.fingerprints:
+            restored.add(digest, fingerprint)
+
+        assert restored.is_duplicate(DOCUMENT) is True
+
+    def test_invalid_max_distance_raises_exception(self):
+        with pytest.raises(ValueError):
+            dedup.DuplicateFilter(max_distance=64)
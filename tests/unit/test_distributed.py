@@ -0,0 +1,223 @@
+from unittest.mock import Mock
+import threading
+import time
+
+import pytest
+import requests
+
+from levatas_indexer import distributed, indexer, scheduler, utils
+
+
+@pytest.fixture(scope='function', params=['memory', 'sqlite'])
+def clock_and_queue(request, tmp_path, clock):
+    if request.param == 'memory':
+        return clock, distributed.MemoryWorkQueue(clock=clock)
+
+    return clock, distributed.SQLiteWorkQueue('job-1',
+                                              path=str(tmp_path.joinpath('queue.sqlite3')),
+                                              clock=clock)
+
+
+@pytest.fixture(scope='function')
+def work_queue(clock_and_queue):
+    return clock_and_queue[1]
+
+
+def run_workers(work_queue, make_indexer, workers, ngram_size=1, make_frontier=utils.Frontier,
+                **kwargs):
+    options = distributed.WorkerOptions(**{'poll_interval': 0.01, **kwargs})
+    threads = [
+        threading.Thread(target=distributed.run_worker,
+                         args=(work_queue,
+                               make_indexer(ngram_size),
+                               f'worker-{i}',
+                               make_frontier(),
+                               options))
+        for i in range(workers)
+    ]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+
+def test_encode_counts_round_trip():
+    counts = {'one': 2, ('one', 'two'): 1}
+
+    assert distributed.decode_counts(distributed.encode_counts(counts)) == counts
+
+
+class TestWorkQueue:
+
+    def test_claims_greatest_depth_first(self, work_queue):
+        work_queue.push_many([('https://google.com/a', 0), ('https://google.com/b', 1)])
+
+        assert work_queue.claim('worker-1') == ('https://google.com/b', 1, True)
+        assert work_queue.claim('worker-1') == ('https://google.com/a', 0, True)
+        assert work_queue.claim('worker-1') is None
+
+    def test_ignores_seen_urls(self, work_queue):
+        work_queue.push('https://google.com', 1)
+        work_queue.claim('worker-1')
+        work_queue.complete('worker-1', [('https://google.com', 1, {'one': 1})])
+        work_queue.push('https://google.com', 1)
+
+        assert work_queue.claim('worker-1') is None
+        assert work_queue.finished() is True
+
+    def test_merges_counts(self, work_queue):
+        work_queue.push_many([('https://google.com/a', 0), ('https://google.com/b', 0)])
+        work_queue.claim('worker-1')
+        work_queue.claim('worker-2')
+
+        assert work_queue.finished() is False
+        assert work_queue.complete('worker-1', [('https://google.com/a', 0, {'one': 1})]) == 1
+        assert work_queue.complete('worker-2', [('https://google.com/b', 0,
+                                                 {'one': 2, ('one', 'two'): 1})]) == 1
+        assert work_queue.counts() == {'one': 3, ('one', 'two'): 1}
+        assert work_queue.finished() is True
+
+    def test_expired_lease_is_reclaimed(self, clock_and_queue):
+        clock, work_queue = clock_and_queue
+        work_queue.push('https://google.com', 0)
+
+        assert work_queue.claim('worker-1', lease=10) is not None
+        assert work_queue.claim('worker-2', lease=10) is None
+
+        clock.now = 11
+
+        assert work_queue.claim('worker-2', lease=10) == ('https://google.com', 0, True)
+        assert work_queue.complete('worker-1', [('https://google.com', 0, {'one': 1})]) == 0
+        assert work_queue.complete('worker-2', [('https://google.com', 0, {'one': 1})]) == 1
+        assert work_queue.counts() == {'one': 1}
+
+    def test_deeper_push_requeues_without_counting_again(self, work_queue):
+        work_queue.push('https://google.com/a', 0)
+        work_queue.claim('worker-1')
+        work_queue.complete('worker-1', [('https://google.com/a', 0, {'one': 1})])
+        work_queue.push('https://google.com/a', 1)
+
+        assert work_queue.claim('worker-1') == ('https://google.com/a', 1, False)
+
+    def test_deeper_push_while_leased(self, work_queue):
+        work_queue.push('https://google.com/a', 0)
+        work_queue.claim('worker-1')
+        work_queue.push('https://google.com/a', 1)
+        work_queue.complete('worker-1', [('https://google.com/a', 0, {'one': 1})])
+
+        assert work_queue.finished() is False
+        assert work_queue.claim('worker-1') == ('https://google.com/a', 1, False)
+
+
+class TestRunWorker:
+
+    @pytest.mark.parametrize('workers', [1, 4])
+    def test_matches_single_process_crawl(self, mock_fetch, work_queue, workers, make_indexer):
+        expected = indexer.index_html_documents('https://google.com', make_indexer())
+
+        work_queue.push('https://google.com', 1)
+        run_workers(work_queue, make_indexer, workers, batch_size=3)
+        word_indexer = make_indexer()
+        word_indexer.merge(work_queue.counts())
+
+        assert word_indexer.index == expected
+
+    def test_matches_single_process_phrases(self, mock_fetch, work_queue, make_indexer):
+        expected = make_indexer(ngram_size=2)
+        indexer.index_html_documents('https://google.com', expected)
+
+        work_queue.push('https://google.com', 1)
+        run_workers(work_queue, make_indexer, 3, ngram_size=2)
+        word_indexer = make_indexer(ngram_size=2)
+        word_indexer.merge(work_queue.counts())
+
+        assert word_indexer.phrases == expected.phrases
+
+    def test_skips_disallowed_urls(self, mock_fetch, work_queue, make_indexer):
+        robots = Mock()
+        robots.can_fetch.side_effect = lambda url: url != 'https://google.com/3'
+        robots.crawl_delay.return_value = None
+
+        work_queue.push('https://google.com', 1)
+        run_workers(work_queue,
+                    make_indexer,
+                    2,
+                    make_frontier=lambda: scheduler.CrawlScheduler(rate=1000.0,
+                                                                   max_rate=1000.0,
+                                                                   robots=robots))
+        urls = [call.args[0] for call in mock_fetch.call_args_list]
+
+        assert 'https://google.com/3' not in urls
+        assert work_queue.counts()['page'] == 19
+
+    def test_paces_requests_to_each_host(self, mock_fetch, work_queue, make_indexer, fetch_response):
+        robots = Mock()
+        robots.can_fetch.return_value = True
+        robots.crawl_delay.return_value = 0.05
+        fetched = []
+
+        def timed_fetch(url, max_size=utils.MAX_PAGE_SIZE):
+            fetched.append(time.monotonic())
+            return fetch_response(url, max_size)
+
+        mock_fetch.side_effect = timed_fetch
+        work_queue.push('https://google.com', 1)
+        run_workers(work_queue,
+                    make_indexer,
+                    1,
+                    make_frontier=lambda: scheduler.CrawlScheduler(rate=1000.0,
+                                                                   max_rate=1000.0,
+                                                                   robots=robots))
+        gaps = [later - earlier for earlier, later in zip(fetched, fetched[1:])]
+
+        assert work_queue.counts()['page'] == 20
+        assert min(gaps) >= 0.04
+
+    @pytest.mark.parametrize('queue_type', ['memory', 'sqlite'])
+    def test_sends_results_before_leases_expire(self, mock_fetch, tmp_path, queue_type, make_indexer, fetch_response):
+        if queue_type == 'memory':
+            work_queue = distributed.MemoryWorkQueue()
+
+        else:
+            work_queue = distributed.SQLiteWorkQueue('job-1',
+                                                     path=str(tmp_path.joinpath('queue.sqlite3')))
+
+        def slow_fetch(url, max_size=utils.MAX_PAGE_SIZE):
+            time.sleep(0.02)
+            return fetch_response(url, max_size)
+
+        mock_fetch.side_effect = slow_fetch
+        work_queue.push('https://google.com', 1)
+        run_workers(work_queue, make_indexer, 3, lease=0.1, batch_size=10)
+        urls = [call.args[0] for call in mock_fetch.call_args_list]
+
+        assert sorted(urls) == sorted(set(urls))
+        assert work_queue.counts()['page'] == 20
+
+    def test_completes_urls_that_fail_to_fetch(self, mock_fetch, work_queue, make_indexer, fetch_response):
+        def fetch_or_fail(url, max_size=utils.MAX_PAGE_SIZE):
+            if url == 'https://google.com/3':
+                raise requests.ConnectionError('connection refused')
+
+            return fetch_response(url, max_size)
+
+        mock_fetch.side_effect = fetch_or_fail
+        work_queue.push('https://google.com', 1)
+        run_workers(work_queue, make_indexer, 2, batch_size=3)
+
+        assert work_queue.finished() is True
+        assert work_queue.counts()['page'] == 19
+
+    def test_sends_counts_before_stopping_on_an_error(self, mock_fetch, work_queue, make_indexer, fetch_response):
+        mock_fetch.side_effect = [fetch_response('https://google.com/1'), ValueError('bad page')]
+        work_queue.push_many([('https://google.com/1', 0), ('https://google.com/2', 0)])
+
+        with pytest.raises(ValueError):
+            distributed.run_worker(work_queue,
+                                   make_indexer(),
+                                   'worker-1',
+                                   options=distributed.WorkerOptions(poll_interval=0.01))
+
+        assert work_queue.counts()['page'] == 1
@@ -2,7 +2,7 @@ from unittest.mock import Mock
 
 import pytest
 
-from levatas_indexer import indexer
+from levatas_indexer import checkpoint, dedup, indexer, processors, utils
 
 
 class TestTokenizer:
@@ -80,11 +80,96 @@ class TestTokenizer:
         mock_word.assert_called()
         mock_document.assert_called()
 
+    def test_normalize_runs_word_processors(self, tokenizer):
+        tokenizer.add_word_processor(str.lower)
+        tokenizer.add_word_processor(str.strip)
+
+        assert tokenizer.normalize(' Running ') == 'running'
+
+    def test_normalize_caches_results(self, tokenizer):
+        mock_word = Mock(return_value='run')
+        tokenizer.add_word_processor(mock_word)
+
+        tokenizer.normalize('Running')
+        tokenizer.normalize('Running')
+
+        assert mock_word.call_count == 1
+
+    def test_adding_word_processor_clears_normalize_cache(self, tokenizer):
+        tokenizer.normalize('Running')
+        tokenizer.add_word_processor(str.lower)
+
+        assert tokenizer.normalize('Running') == 'running'
+
     def test_tokenize_splits_on_delimiter(self, tokenizer):
         result = tokenizer.tokenize('one  two three four\tfive')
 
         assert result == ['one', 'two', 'three', 'four\tfive']
 
+    def test_iter_tokens_is_lazy(self, tokenizer):
+        mock_word = Mock(side_effect=lambda word: word)
+        tokenizer.add_word_processor(mock_word)
+
+        tokens = tokenizer.iter_tokens('one two three')
+
+        assert next(tokens) == 'one'
+        assert mock_word.call_count == 1
+
+    @pytest.mark.parametrize('delimiter,text', [
+        (' ', ''),
+        (' ', ' one  two '),
+        (', ', 'one, two,three, , four')
+    ])
+    def test_iter_tokens_matches_split(self, delimiter, text):
+        tokenizer = indexer.Tokenizer(delimiter)
+
+        result = list(tokenizer.iter_tokens(text))
+
+        assert result == [word for word in text.split(delimiter) if word]
+
+
+class TestIterChunks:
+
+    def test_short_text_is_a_single_chunk(self):
+        assert list(indexer.iter_chunks('one two', chunk_size=100)) == ['one two']
+
+    def test_empty_text_is_a_single_chunk(self):
+        assert list(indexer.iter_chunks('')) == ['']
+
+    def test_chunks_rebuild_the_text(self):
+        text = ' '.join(f'word{i}' for i in range(1000))
+
+        chunks = list(indexer.iter_chunks(text, chunk_size=64))
+
+        assert ''.join(chunks) == text
+        assert len(chunks) > 1
+
+    def test_words_are_never_split(self):
+        text = ' '.join(f'word{i}' for i in range(1000))
+
+        for chunk in indexer.iter_chunks(text, chunk_size=64):
+            assert chunk.split() == [word for word in chunk.split() if word.startswith('word')]
+            assert chunk[-1] == ' ' or text.endswith(chunk)
+
+    def test_prefers_line_breaks(self):
+        text = 'one two three.\nfour five six seven eight'
+
+        chunks = list(indexer.iter_chunks(text, chunk_size=20))
+
+        assert chunks[0] == 'one two three.\n'
+
+    def test_prefers_sentence_endings(self):
+        text = 'one two three. four five six seven eight'
+
+        chunks = list(indexer.iter_chunks(text, chunk_size=20))
+
+        assert chunks[0] == 'one two three. '
+
+    def test_long_words_are_kept_whole(self):
+        text = 'a' * 50 + ' b'
+
+        assert list(indexer.iter_chunks(text, chunk_size=10)) == ['a' * 50 + ' ', 'b']
+
 
 class TestNLTKTokenizer:
     @pytest.fixture(scope='function')
@@ -118,6 +203,17 @@ class TestNLTKTokenizer:
         mock_word.assert_called()
         mock_document.assert_called()
 
+    def test_tokenizes_in_chunks(self, monkeypatch):
+        mock = Mock(side_effect=str.split)
+        monkeypatch.setattr('nltk.word_tokenize', mock)
+        nltk_tokenizer = indexer.NLTKTokenizer(chunk_size=20)
+        text = ' '.join(f'word{i}' for i in range(20))
+
+        result = nltk_tokenizer.tokenize(text)
+
+        assert result == text.split()
+        assert mock.call_count > 1
+
 
 class TestWordIndexer:
 
@@ -133,7 +229,7 @@ class TestWordIndexer:
 
     def test_index_text_counts_words(self, word_indexer):
         words = ['one', 'two', 'two', 'three', 'four', 'two', 'three']
-        word_indexer.tokenizer.tokenize = Mock(return_value=words)
+        word_indexer.tokenizer.iter_tokens = Mock(side_effect=lambda _: iter(words))
         word_indexer.index_text('')
 
         index = word_indexer.index
@@ -146,7 +242,7 @@ class TestWordIndexer:
 
     def test_index_text_persists_across_calls(self, word_indexer):
         words = ['one', 'two', 'two', 'three', 'four', 'two', 'three']
-        word_indexer.tokenizer.tokenize = Mock(return_value=words)
+        word_indexer.tokenizer.iter_tokens = Mock(side_effect=lambda _: iter(words))
         word_indexer.index_text('')
         word_indexer.index_text('')
 
@@ -158,6 +254,16 @@ class TestWordIndexer:
         assert index['four'] == 2
         assert 'five' not in index
 
+    def test_index_text_returns_document_counts(self, word_indexer):
+        word_indexer._words['one'] = 5
+        words = ['one', 'two', 'two']
+        word_indexer.tokenizer.iter_tokens = Mock(side_effect=lambda _: iter(words))
+
+        result = word_indexer.index_text('')
+
+        assert result == {'one': 1, 'two': 2}
+        assert word_indexer.index == {'one': 6, 'two': 2}
+
     def test_count_returns_correct_count(self, word_indexer):
         word_indexer._words['one'] = 99
         word_indexer._words['two'] = 35
@@ -165,3 +271,293 @@ class TestWordIndexer:
         assert word_indexer.count('one') == 99
         assert word_indexer.count('two') == 35
         assert word_indexer.count('three') == 0
+
+    def test_merge_adds_counts(self, word_indexer):
+        word_indexer._words['one'] = 1
+
+        word_indexer.merge({'one': 2, 'two': 3})
+
+        assert word_indexer.index == {'one': 3, 'two': 3}
+
+    def test_query_normalizes_words(self):
+        tokenizer = indexer.Tokenizer()
+        tokenizer.add_word_processor(processors.cast_text_to_lower)
+        tokenizer.add_word_processor(processors.stem_word)
+        word_indexer = indexer.WordIndexer(tokenizer)
+        word_indexer._words['run'] = 4
+        word_indexer._words['walk'] = 2
+
+        result = word_indexer.query(['Running', 'runs', 'walked', 'swim'])
+
+        assert result == {'Running': 4, 'runs': 4, 'walked': 2, 'swim': 0}
+
+    def test_query_handles_words_removed_by_processors(self):
+        tokenizer = indexer.Tokenizer()
+        tokenizer.add_word_processor(processors.remove_numeric_values)
+        word_indexer = indexer.WordIndexer(tokenizer)
+        word_indexer._words[''] = 10
+
+        assert word_indexer.query(['100']) == {'100': 0}
+
+    def test_query_accepts_a_single_word(self):
+        word_indexer = indexer.WordIndexer(indexer.Tokenizer())
+        word_indexer._words['run'] = 4
+
+        assert word_indexer.query('run') == {'run': 4}
+
+
+class TestWordIndexerPhrases:
+
+    @pytest.fixture(scope='function')
+    def word_indexer(self):
+        return indexer.WordIndexer(indexer.Tokenizer(), ngram_size=3)
+
+    def test_counts_phrases_in_the_same_pass(self, word_indexer):
+        word_indexer.index_text('new york is new york')
+
+        assert word_indexer.count('new') == 2
+        assert word_indexer.count(('new', 'york')) == 2
+        assert word_indexer.count(('york', 'is')) == 1
+        assert word_indexer.count(('new', 'york', 'is')) == 1
+        assert word_indexer.count(('is', 'new', 'york')) == 1
+        assert word_indexer.count(('york', 'new')) == 0
+        assert word_indexer.count(('new', 'york', 'is', 'new')) == 0
+
+    def test_phrases_do_not_span_documents(self, word_indexer):
+        word_indexer.index_text('new')
+        word_indexer.index_text('york')
+
+        assert word_indexer.count(('new', 'york')) == 0
+
+    def test_index_text_returns_phrase_counts(self, word_indexer):
+        result = word_indexer.index_text('one two one two')
+
+        assert result == {'one': 2, 'two': 2, ('one', 'two'): 2, ('two', 'one'): 1,
+                          ('one', 'two', 'one'): 1, ('two', 'one', 'two'): 1}
+
+    def test_phrases_property_decodes_keys(self, word_indexer):
+        word_indexer.index_text('one two three')
+
+        assert word_indexer.phrases == {('one', 'two'): 1, ('two', 'three'): 1,
+                                        ('one', 'two', 'three'): 1}
+
+    def test_phrase_keys_are_integers(self, word_indexer):
+        word_indexer.index_text('one two three')
+
+        assert all(isinstance(key, int) for key in word_indexer._phrases)
+
+    def test_merge_adds_phrase_counts(self, word_indexer):
+        word_indexer.index_text('one two')
+
+        word_indexer.merge({('one', 'two'): 3, ('two', 'three'): 1})
+
+        assert word_indexer.count(('one', 'two')) == 4
+        assert word_indexer.count(('two', 'three')) == 1
+
+    def test_prune_drops_rare_phrases(self, word_indexer):
+        word_indexer.index_text('one two one two three')
+
+        word_indexer.prune(2)
+
+        assert word_indexer.phrases == {('one', 'two'): 2}
+        assert word_indexer.count('one') == 2
+
+    def test_frequent_phrases_survive_pruning(self):
+        word_indexer = indexer.WordIndexer(indexer.Tokenizer(), ngram_size=2)
+
+        for i in range(1000):
+            word_indexer.index_text(f'new york {i}')
+
+        word_indexer.prune(2)
+
+        assert word_indexer.phrases == {('new', 'york'): 1000}
+        assert word_indexer.count(('new', 'york')) == 1000
+
+    def test_merge_does_not_prune(self, word_indexer):
+        for i in range(100):
+            word_indexer.index_text(f'new york {i}')
+
+        assert word_indexer.count(('york', '7')) == 1
+        assert word_indexer.count(('new', 'york')) == 100
+
+    def test_query_normalizes_phrases(self, word_indexer):
+        word_indexer.tokenizer.add_word_processor(processors.cast_text_to_lower)
+        word_indexer.tokenizer.add_word_processor(processors.remove_numeric_values)
+        word_indexer.index_text('New York in 2020 was busy')
+
+        result = word_indexer.query(['NEW  York', 'in 2020 was', 'york was'])
+
+        assert result == {'NEW  York': 1, 'in 2020 was': 1, 'york was': 0}
+
+    def test_count_looks_up_tokens_containing_spaces(self):
+        word_indexer = indexer.WordIndexer(indexer.Tokenizer(delimiter=','), ngram_size=2)
+
+        word_indexer.index_text('new york,boston,new york')
+
+        assert word_indexer.count('new york') == 2
+        assert word_indexer.count(('new york', 'boston')) == 1
+        assert word_indexer.query(['new york', 'new york,boston']) == {'new york': 2,
+                                                                       'new york,boston': 1}
+
+    def test_single_words_are_not_phrases(self):
+        word_indexer = indexer.WordIndexer(indexer.Tokenizer())
+
+        assert word_indexer.index_text('one two') == {'one': 1, 'two': 1}
+        assert word_indexer.count(('one', 'two')) == 0
+        assert word_indexer.phrases == {}
+
+    def test_invalid_ngram_size_raises_exception(self):
+        with pytest.raises(ValueError):
+            indexer.WordIndexer(indexer.Tokenizer(), ngram_size=0)
+
+
+class TestIndexHtmlDocuments:
+
+    @pytest.fixture(scope='function')
+    def word_indexer(self):
+        tokenizer = indexer.Tokenizer()
+        return indexer.WordIndexer(tokenizer)
+
+    def test_indexes_every_document(self, word_indexer, monkeypatch):
+        pages = [('https://google.com', 'one two'),
+                 ('https://google.com/a', 'one two'),
+                 ('https://google.com/b', 'three')]
+        monkeypatch.setattr('levatas_indexer.utils.crawl_pages', Mock(return_value=iter(pages)))
+
+        result = indexer.index_html_documents('https://google.com', word_indexer)
+
+        assert result == {'one': 2, 'two': 2, 'three': 1}
+
+    def test_skips_duplicate_documents(self, word_indexer, monkeypatch):
+        pages = [('https://google.com', 'one two'),
+                 ('https://google.com/a', '<p>one two</p>'),
+                 ('https://google.com/b', 'three')]
+        monkeypatch.setattr('levatas_indexer.utils.crawl_pages', Mock(return_value=iter(pages)))
+        duplicate_filter = dedup.DuplicateFilter()
+
+        result = indexer.index_html_documents('https://google.com',
+                                              word_indexer,
+                                              duplicate_filter=duplicate_filter)
+
+        assert result == {'one': 1, 'two': 1, 'three': 1}
+        assert duplicate_filter.skipped == 1
+
+    def test_collects_document_counts(self, word_indexer, monkeypatch):
+        pages = [('https://google.com', 'one two one'), ('https://google.com/a', 'three')]
+        monkeypatch.setattr('levatas_indexer.utils.crawl_pages', Mock(return_value=iter(pages)))
+        document_counts = {}
+
+        indexer.index_html_documents('https://google.com',
+                                     word_indexer,
+                                     document_counts=document_counts)
+
+        assert document_counts == {'https://google.com': {'one': 2, 'two': 1},
+                                   'https://google.com/a': {'three': 1}}
+
+
+class TestIndexHtmlDocumentsCheckpoint:
+
+    PAGES = {
+        'https://google.com': 'root <a href="/a">a</a> <a href="/b">b</a> <a href="/c">c</a>',
+        'https://google.com/a': 'apple',
+        'https://google.com/b': 'banana',
+        'https://google.com/c': 'cherry'
+    }
+
+    @pytest.fixture(scope='function')
+    def job_checkpoint(self, tmp_path):
+        return checkpoint.Checkpoint('job', path=str(tmp_path.joinpath('checkpoints.sqlite3')))
+
+    def fetch(self, fetched, fail_on=None):
+        def fetch_response(url, max_size=utils.MAX_PAGE_SIZE):
+            if url == fail_on:
+                raise RuntimeError('worker died')
+
+            fetched.append(url)
+            return utils.FetchResult(url, 200, {}, self.PAGES[url], 0.1)
+
+        return fetch_response
+
+    def test_resumes_without_refetching(self, job_checkpoint, monkeypatch):
+        monkeypatch.setattr(utils, 'fetch_response', self.fetch([]))
+        expected = indexer.index_html_documents('https://google.com',
+                                                indexer.WordIndexer(indexer.Tokenizer()))
+        fetched = []
+        monkeypatch.setattr(utils, 'fetch_response', self.fetch(fetched, fail_on='https://google.com/c'))
+
+        with pytest.raises(RuntimeError):
+            indexer.index_html_documents('https://google.com',
+                                         indexer.WordIndexer(indexer.Tokenizer()),
+                                         checkpoint=job_checkpoint,
+                                         checkpoint_interval=1)
+
+        resumed = []
+        monkeypatch.setattr(utils, 'fetch_response', self.fetch(resumed))
+        result = indexer.index_html_documents('https://google.com',
+                                              indexer.WordIndexer(indexer.Tokenizer()),
+                                              checkpoint=job_checkpoint,
+                                              checkpoint_interval=1)
+
+        assert result == expected
+        assert sorted(fetched + resumed) == sorted(self.PAGES)
+        assert job_checkpoint.load().complete is True
+
+    def test_resumes_phrase_counts(self, job_checkpoint, monkeypatch):
+        monkeypatch.setattr(utils, 'fetch_response', self.fetch([]))
+        indexer.index_html_documents('https://google.com',
+                                     indexer.WordIndexer(indexer.Tokenizer(), ngram_size=2),
+                                     checkpoint=job_checkpoint)
+
+        resumed = indexer.WordIndexer(indexer.Tokenizer(), ngram_size=2)
+        indexer.index_html_documents('https://google.com', resumed, checkpoint=job_checkpoint)
+
+        assert resumed.count(('root', '<a')) == 1
+
+    def test_completed_job_is_not_crawled_again(self, job_checkpoint, monkeypatch):
+        fetched = []
+        monkeypatch.setattr(utils, 'fetch_response', self.fetch(fetched))
+
+        first = indexer.index_html_documents('https://google.com',
+                                             indexer.WordIndexer(indexer.Tokenizer()),
+                                             checkpoint=job_checkpoint)
+        fetched.clear()
+        second = indexer.index_html_documents('https://google.com',
+                                              indexer.WordIndexer(indexer.Tokenizer()),
+                                              checkpoint=job_checkpoint)
+
+        assert first == second
+        assert fetched == []
+
+    def test_job_held_by_another_run_is_not_crawled(self, job_checkpoint, monkeypatch):
+        fetched = []
+        monkeypatch.setattr(utils, 'fetch_response', self.fetch(fetched))
+        checkpoint.Checkpoint('job', path=job_checkpoint.path).acquire('https://google.com')
+
+        with pytest.raises(checkpoint.JobLockedError):
+            indexer.index_html_documents('https://google.com',
+                                         indexer.WordIndexer(indexer.Tokenizer()),
+                                         checkpoint=job_checkpoint)
+
+        assert fetched == []
+        assert job_checkpoint.load().counts == {}
+
+    def test_saves_only_new_progress(self, job_checkpoint, monkeypatch):
+        monkeypatch.setattr(utils, 'fetch_response', self.fetch([]))
+        saves = []
+        save = job_checkpoint.save
+
+        def record_save(url, pending, visited, counts, **kwargs):
+            saves.append((list(visited), dict(counts)))
+            save(url, pending, visited, counts, **kwargs)
+
+        monkeypatch.setattr(job_checkpoint, 'save', record_save)
+        expected = indexer.index_html_documents('https://google.com',
+                                                indexer.WordIndexer(indexer.Tokenizer()),
+                                                checkpoint=job_checkpoint,
+                                                checkpoint_interval=1)
+
+        visited = [url for urls, _ in saves for url in urls]
+
+        assert sorted(visited) == sorted(set(visited))
+        assert saves[-1] == ([], {})
+        assert job_checkpoint.load().counts == expected
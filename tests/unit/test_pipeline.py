@@ -0,0 +1,136 @@
+from unittest.mock import Mock
+import threading
+import time
+
+import pytest
+import requests
+
+from levatas_indexer import dedup, indexer, pipeline, scheduler, utils
+
+class TestCrawlPipeline:
+
+    @pytest.mark.parametrize('fetchers,parsers', [(1, 1), (4, 1), (4, 3)])
+    def test_matches_sequential_crawl(self, mock_fetch, fetchers, parsers, make_indexer):
+        expected = indexer.index_html_documents('https://google.com', make_indexer())
+
+        crawl_pipeline = pipeline.CrawlPipeline(make_indexer(), fetchers=fetchers, parsers=parsers)
+        result = crawl_pipeline.run('https://google.com')
+
+        assert result == expected
+        assert crawl_pipeline.metrics['indexed'] == 21
+
+    def test_fetches_each_url_once(self, mock_fetch, make_indexer):
+        pipeline.CrawlPipeline(make_indexer(), fetchers=8).run('https://google.com', depth=2)
+
+        urls = [call.args[0] for call in mock_fetch.call_args_list]
+
+        assert sorted(urls) == sorted(set(urls))
+        assert 'https://google.com/20' in urls
+
+    def test_skips_duplicates(self, mock_fetch, make_indexer, pages):
+        pages['https://google.com/1'] = pages['https://google.com/0']
+        duplicate_filter = dedup.DuplicateFilter(max_distance=0)
+        crawl_pipeline = pipeline.CrawlPipeline(make_indexer(), duplicate_filter=duplicate_filter)
+
+        crawl_pipeline.run('https://google.com')
+
+        assert crawl_pipeline.metrics['skipped'] == 1
+        assert duplicate_filter.skipped == 1
+
+    def test_collects_document_counts(self, mock_fetch, make_indexer):
+        document_counts = {}
+        crawl_pipeline = pipeline.CrawlPipeline(make_indexer(), document_counts=document_counts)
+
+        crawl_pipeline.run('https://google.com')
+
+        assert len(document_counts) == 21
+        assert document_counts['https://google.com/3']['page'] == 1
+
+    def test_queue_is_bounded(self, mock_fetch, make_indexer):
+        word_indexer = make_indexer()
+        count_text = word_indexer.count_text
+
+        def slow_count_text(text):
+            time.sleep(0.005)
+            return count_text(text)
+
+        word_indexer.count_text = slow_count_text
+        crawl_pipeline = pipeline.CrawlPipeline(word_indexer, fetchers=4, max_queue=2)
+
+        crawl_pipeline.run('https://google.com')
+
+        metrics = crawl_pipeline.metrics
+        assert metrics['max_queued'] <= 2
+        assert metrics['blocked_seconds'] > 0
+        assert metrics['queued'] == 0
+        assert metrics['fetching'] == 0
+        assert metrics['frontier'] == 0
+
+    def test_dead_links_are_indexed_as_empty_pages(self, mock_fetch, make_indexer, fetch_response):
+        def fetch(url, max_size=utils.MAX_PAGE_SIZE):
+            if url == 'https://google.com/5':
+                raise requests.ConnectionError('connection refused')
+
+            return fetch_response(url)
+
+        mock_fetch.side_effect = fetch
+        crawl_pipeline = pipeline.CrawlPipeline(make_indexer(), fetchers=4)
+        result = crawl_pipeline.run('https://google.com')
+
+        assert result['page'] == 19
+        assert crawl_pipeline.metrics['indexed'] == 21
+
+    def test_only_fetchers_with_a_url_are_fetching(self, mock_fetch, make_indexer, fetch_response):
+        crawl_pipeline = pipeline.CrawlPipeline(make_indexer(), fetchers=4,
+                                                frontier=scheduler.CrawlScheduler(rate=50.0))
+        fetching = []
+
+        def fetch(url, max_size=utils.MAX_PAGE_SIZE):
+            fetching.append(crawl_pipeline.metrics['fetching'])
+            return fetch_response(url)
+
+        mock_fetch.side_effect = fetch
+        crawl_pipeline.run('https://google.com')
+
+        assert max(fetching) == 1
+
+    def test_fetch_errors_are_raised(self, mock_fetch, make_indexer, fetch_response):
+        def fetch(url, max_size=utils.MAX_PAGE_SIZE):
+            if url == 'https://google.com/5':
+                raise RuntimeError('connection reset')
+
+            return fetch_response(url)
+
+        mock_fetch.side_effect = fetch
+
+        with pytest.raises(RuntimeError, match='connection reset'):
+            pipeline.CrawlPipeline(make_indexer()).run('https://google.com')
+
+    def test_parse_errors_are_raised(self, mock_fetch, make_indexer):
+        word_indexer = make_indexer()
+        word_indexer.count_text = Mock(side_effect=ValueError('bad page'))
+
+        with pytest.raises(ValueError, match='bad page'):
+            pipeline.CrawlPipeline(word_indexer).run('https://google.com')
+
+    def test_errors_stop_fetchers_waiting_on_a_host(self, mock_fetch, make_indexer):
+        word_indexer = make_indexer()
+        word_indexer.count_text = Mock(side_effect=ValueError('bad page'))
+        crawl_scheduler = scheduler.CrawlScheduler(rate=0.001)
+        start = time.monotonic()
+
+        with pytest.raises(ValueError, match='bad page'):
+            pipeline.CrawlPipeline(word_indexer, frontier=crawl_scheduler).run('https://google.com')
+
+        assert time.monotonic() - start < 5
+
+    def test_threads_shut_down(self, mock_fetch, make_indexer):
+        before = threading.active_count()
+
+        pipeline.CrawlPipeline(make_indexer(), fetchers=4, parsers=2).run('https://google.com')
+
+        assert threading.active_count() == before
+
+    def test_invalid_worker_counts_raise_exception(self, make_indexer):
+        with pytest.raises(ValueError):
+            pipeline.CrawlPipeline(make_indexer(), fetchers=0)
@@ -0,0 +1,220 @@
+from unittest.mock import Mock
+import threading
+
+import pytest
+
+from levatas_indexer import scheduler, utils
+
+
+def make_result(url, status=200, headers=None, elapsed=0.1):
+    return utils.FetchResult(url, status, headers or {}, '', elapsed)
+
+
+class TestParseRetryAfter:
+
+    @pytest.mark.parametrize('value,expected', [
+        (None, None),
+        ('', None),
+        ('120', 120.0),
+        (' 5 ', 5.0),
+        ('soon', None),
+        ('Wed, 21 Oct 2015 07:28:00 GMT', 0.0)
+    ])
+    def test_values(self, value, expected):
+        assert scheduler.parse_retry_after(value) == expected
+
+
+class TestTokenBucket:
+
+    @pytest.fixture(scope='function')
+    def bucket(self):
+        return scheduler.TokenBucket(rate=2.0, capacity=1.0, min_rate=0.5, max_rate=4.0, now=0.0)
+
+    def test_first_reservation_does_not_wait(self, bucket):
+        assert bucket.reserve(0.0) == 0.0
+
+    def test_reservations_are_spaced_by_rate(self, bucket):
+        bucket.reserve(0.0)
+
+        assert bucket.reserve(0.0) == pytest.approx(0.5)
+        assert bucket.reserve(0.0) == pytest.approx(1.0)
+
+    def test_tokens_refill(self, bucket):
+        bucket.reserve(0.0)
+
+        assert bucket.delay(0.5) == pytest.approx(0.0)
+
+    def test_block_delays_tokens(self, bucket):
+        bucket.block(0.0, 10.0)
+
+        assert bucket.delay(0.0) == pytest.approx(10.0)
+
+    def test_rate_is_bounded(self, bucket):
+        bucket.speed_up(10.0)
+        assert bucket.rate == 4.0
+
+        bucket.slow_down(0.01)
+        assert bucket.rate == 0.5
+
+    def test_limit_lowers_max_rate(self, bucket):
+        bucket.limit(0.25)
+
+        assert bucket.rate == 0.25
+        assert bucket.max_rate == 0.25
+        assert bucket.min_rate == 0.25
+
+
+class TestRobotsCache:
+
+    @pytest.fixture(scope='function')
+    def mock_get(self, monkeypatch):
+        mock_get = Mock()
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.text = 'User-agent: *\nDisallow: /private\nCrawl-delay: 2\n'
+        monkeypatch.setattr('requests.get', mock_get)
+        return mock_get
+
+    def test_disallowed_urls(self, mock_get):
+        robots = scheduler.RobotsCache()
+
+        assert robots.can_fetch('https://google.com/public') is True
+        assert robots.can_fetch('https://google.com/private/page') is False
+
+    def test_crawl_delay(self, mock_get):
+        robots = scheduler.RobotsCache()
+
+        assert robots.crawl_delay('https://google.com/') == 2.0
+
+    def test_fetches_once_per_host(self, mock_get):
+        robots = scheduler.RobotsCache()
+
+        robots.can_fetch('https://google.com/one')
+        robots.can_fetch('https://google.com/two')
+        robots.can_fetch('https://example.com/one')
+
+        assert mock_get.call_count == 2
+
+    def test_refetches_after_max_age(self, mock_get, clock):
+        robots = scheduler.RobotsCache(max_age=60, clock=clock)
+
+        robots.can_fetch('https://google.com/one')
+        clock.now = 61
+        robots.can_fetch('https://google.com/one')
+
+        assert mock_get.call_count == 2
+
+    @pytest.mark.parametrize('status,expected', [
+        (404, True),
+        (500, True),
+        (401, False),
+        (403, False)
+    ])
+    def test_error_statuses(self, mock_get, status, expected):
+        mock_get.return_value.status_code = status
+        robots = scheduler.RobotsCache()
+
+        assert robots.can_fetch('https://google.com/public') is expected
+
+
+class TestCrawlScheduler:
+
+    @pytest.fixture(scope='function')
+    def crawl_scheduler(self, clock):
+        return scheduler.CrawlScheduler(rate=1.0, clock=clock, sleep=clock.sleep)
+
+    def test_empty_scheduler_returns_none(self, crawl_scheduler):
+        assert crawl_scheduler.pop() is None
+
+    def test_interleaves_hosts(self, crawl_scheduler, clock):
+        crawl_scheduler.push('https://one.com/a', 0)
+        crawl_scheduler.push('https://one.com/b', 0)
+        crawl_scheduler.push('https://two.com/a', 0)
+        crawl_scheduler.push('https://two.com/b', 0)
+
+        urls = [crawl_scheduler.pop()[0] for _ in range(4)]
+
+        assert urls == ['https://one.com/a', 'https://two.com/a',
+                        'https://one.com/b', 'https://two.com/b']
+        assert clock.now == pytest.approx(1.0)
+        assert crawl_scheduler.pop() is None
+
+    def test_paces_a_single_host(self, crawl_scheduler, clock):
+        for path in 'abc':
+            crawl_scheduler.push(f'https://one.com/{path}', 0)
+
+        for _ in range(3):
+            crawl_scheduler.pop()
+
+        assert clock.now == pytest.approx(2.0)
+
+    def test_close_wakes_waiting_pop(self):
+        crawl_scheduler = scheduler.CrawlScheduler(rate=0.001)
+        crawl_scheduler.push('https://one.com/a', 0)
+        crawl_scheduler.push('https://one.com/b', 0)
+        crawl_scheduler.pop()
+        threading.Timer(0.05, crawl_scheduler.close).start()
+
+        assert crawl_scheduler.pop() is None
+        assert crawl_scheduler.pending() == [('https://one.com/b', 0)]
+
+    def test_pending_lists_every_url(self, crawl_scheduler):
+        crawl_scheduler.push('https://one.com/a', 1)
+        crawl_scheduler.push('https://two.com/a', 0)
+
+        assert len(crawl_scheduler) == 2
+        assert crawl_scheduler.pending() == [('https://one.com/a', 1), ('https://two.com/a', 0)]
+
+    def test_fast_responses_speed_up_host(self, crawl_scheduler):
+        crawl_scheduler.push('https://one.com/a', 0)
+        crawl_scheduler.pop()
+        crawl_scheduler.record(make_result('https://one.com/a', elapsed=0.1))
+
+        assert crawl_scheduler._buckets['https://one.com'].rate == 1.5
+
+    def test_slow_responses_slow_down_host(self, crawl_scheduler):
+        crawl_scheduler.push('https://one.com/a', 0)
+        crawl_scheduler.pop()
+        crawl_scheduler.record(make_result('https://one.com/a', elapsed=5.0))
+
+        assert crawl_scheduler._buckets['https://one.com'].rate == 0.5
+
+    def test_throttled_url_is_retried_after_retry_after(self, crawl_scheduler, clock):
+        crawl_scheduler.push('https://one.com/a', 1)
+        crawl_scheduler.push('https://two.com/a', 0)
+        crawl_scheduler.pop()
+        crawl_scheduler.record(make_result('https://one.com/a', status=429,
+                                           headers={'Retry-After': '30'}))
+
+        assert crawl_scheduler.pop() == ('https://two.com/a', 0)
+        assert crawl_scheduler.pop() == ('https://one.com/a', 1)
+        assert clock.now == pytest.approx(30.0)
+
+    def test_throttled_url_is_retried_a_limited_number_of_times(self, crawl_scheduler):
+        crawl_scheduler.push('https://one.com/a', 0)
+
+        for _ in range(scheduler.MAX_ATTEMPTS):
+            assert crawl_scheduler.pop() == ('https://one.com/a', 0)
+            crawl_scheduler.record(make_result('https://one.com/a', status=503))
+
+        assert crawl_scheduler.pop() is None
+
+    def test_allowed_applies_robots(self, crawl_scheduler):
+        robots = Mock()
+        robots.can_fetch.return_value = False
+        robots.crawl_delay.return_value = 4.0
+        crawl_scheduler.robots = robots
+
+        assert crawl_scheduler.allowed('https://one.com/a') is False
+        assert crawl_scheduler._buckets['https://one.com'].max_rate == 0.25
+
+    def test_throttled_url_is_skipped_past_max_wait(self, clock):
+        crawl_scheduler = scheduler.CrawlScheduler(max_wait=5.0, clock=clock, sleep=clock.sleep)
+        crawl_scheduler.push('https://one.com/a', 0)
+        crawl_scheduler.push('https://one.com/b', 0)
+        crawl_scheduler.pop()
+        crawl_scheduler.record(make_result('https://one.com/a', status=429,
+                                           headers={'Retry-After': '300'}))
+
+        assert crawl_scheduler.pop() == ('https://one.com/b', 0)
+        assert clock.now == pytest.approx(5.0)
+        assert crawl_scheduler.pop() is None
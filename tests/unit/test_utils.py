@@ -22,13 +22,93 @@ class TestFetchPage:
     def test_returns_document(self, monkeypatch):
         mock_get = Mock()
         mock_get.return_value.status_code = 200
-        mock_get.return_value.text = 'Some content'
+        mock_get.return_value.headers = {'Content-Type': 'text/html'}
+        mock_get.return_value.encoding = 'utf-8'
+        mock_get.return_value.iter_content.return_value = [b'Some ', b'content']
         monkeypatch.setattr('requests.get', mock_get)
 
         result = utils.fetch_page('https://google.com')
 
         assert result == 'Some content'
 
+    def test_decodes_characters_split_across_chunks(self, monkeypatch):
+        encoded = 'naïve café'.encode('utf-8')
+        mock_get = Mock()
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.headers = {'Content-Type': 'text/html; charset=utf-8'}
+        mock_get.return_value.encoding = 'utf-8'
+        mock_get.return_value.iter_content.return_value = [encoded[:3], encoded[3:]]
+        monkeypatch.setattr('requests.get', mock_get)
+
+        result = utils.fetch_page('https://google.com')
+
+        assert result == 'naïve café'
+
+    def test_skips_non_html_content(self, monkeypatch):
+        mock_get = Mock()
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.headers = {'Content-Type': 'application/pdf'}
+        monkeypatch.setattr('requests.get', mock_get)
+
+        result = utils.fetch_page('https://google.com')
+
+        assert result == ''
+        mock_get.return_value.iter_content.assert_not_called()
+        mock_get.return_value.close.assert_called()
+
+    def test_skips_content_length_over_max_size(self, monkeypatch):
+        mock_get = Mock()
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.headers = {'Content-Type': 'text/html', 'Content-Length': '11'}
+        monkeypatch.setattr('requests.get', mock_get)
+
+        result = utils.fetch_page('https://google.com', max_size=10)
+
+        assert result == ''
+        mock_get.return_value.iter_content.assert_not_called()
+
+    def test_abandons_streamed_body_over_max_size(self, monkeypatch):
+        mock_get = Mock()
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.headers = {'Content-Type': 'text/html'}
+        mock_get.return_value.encoding = 'utf-8'
+        mock_get.return_value.iter_content.return_value = [b'123456', b'789012']
+        monkeypatch.setattr('requests.get', mock_get)
+
+        result = utils.fetch_page('https://google.com', max_size=10)
+
+        assert result == ''
+
+
+class TestIsHtmlContentType:
+
+    @pytest.mark.parametrize('content_type,expected', [
+        ('text/html', True),
+        ('text/html; charset=utf-8', True),
+        ('TEXT/HTML', True),
+        ('application/xhtml+xml', True),
+        ('', True),
+        ('application/pdf', False),
+        ('image/png', False),
+        ('text/plain', False)
+    ])
+    def test_content_types(self, content_type, expected):
+        assert utils.is_html_content_type(content_type) is expected
+
+
+class TestHasSkippedExtension:
+
+    @pytest.mark.parametrize('url,expected', [
+        ('https://google.com', False),
+        ('https://google.com/about', False),
+        ('https://google.com/index.html', False),
+        ('https://google.com/report.PDF', True),
+        ('https://google.com/logo.png?size=large', True),
+        ('https://google.com/archive.zip#download', True)
+    ])
+    def test_extensions(self, url, expected):
+        assert utils.has_skipped_extension(url) is expected
+
 
 class TestParseHtml:
 
@@ -64,3 +144,66 @@ class TestSanitizeHref:
             utils.sanitize_href(host_url, href)
 
             assert exc.msg == f'{href} is not a valid url.'
+
+
+class TestFrontier:
+
+    def test_is_first_in_first_out(self):
+        frontier = utils.Frontier()
+        frontier.push('https://google.com/a', 1)
+        frontier.push('https://google.com/b', 0)
+
+        assert len(frontier) == 2
+        assert frontier.pending() == [('https://google.com/a', 1), ('https://google.com/b', 0)]
+        assert frontier.pop() == ('https://google.com/a', 1)
+        assert frontier.pop() == ('https://google.com/b', 0)
+        assert frontier.pop() is None
+
+
+class TestCrawlPages:
+
+    PAGES = {
+        'https://google.com': '<a href="/a">a</a><a href="/b">b</a><a href="/logo.png">logo</a>',
+        'https://google.com/a': '<a href="/c">c</a><a href="https://google.com">root</a>',
+        'https://google.com/b': 'b',
+        'https://google.com/c': 'c'
+    }
+
+    @pytest.fixture(scope='function')
+    def mock_fetch(self, monkeypatch):
+        def fetch(url, max_size=utils.MAX_PAGE_SIZE):
+            return utils.FetchResult(url, 200, {}, self.PAGES.get(url, ''), 0.1)
+
+        mock_fetch = Mock(side_effect=fetch)
+        monkeypatch.setattr(utils, 'fetch_response', mock_fetch)
+        return mock_fetch
+
+    def test_fetches_links_up_to_depth(self, mock_fetch):
+        result = dict(utils.crawl_pages('https://google.com', set(), depth=1))
+
+        assert set(result) == {'https://google.com', 'https://google.com/a', 'https://google.com/b'}
+
+    def test_fetches_each_url_once(self, mock_fetch):
+        list(utils.crawl_pages('https://google.com', set(), depth=2))
+
+        urls = [call.args[0] for call in mock_fetch.call_args_list]
+
+        assert sorted(urls) == sorted(set(urls))
+        assert 'https://google.com/c' in urls
+        assert 'https://google.com/logo.png' not in urls
+
+    def test_skips_disallowed_urls(self, mock_fetch):
+        frontier = utils.Frontier()
+        frontier.allowed = lambda url: url != 'https://google.com/b'
+
+        result = dict(utils.crawl_pages('https://google.com', set(), frontier=frontier))
+
+        assert 'https://google.com/b' not in result
+
+    def test_links_are_queued_before_page_is_yielded(self, mock_fetch):
+        frontier = utils.Frontier()
+        pages = utils.crawl_pages('https://google.com', set(), frontier=frontier)
+
+        next(pages)
+
+        assert sorted(frontier.pending()) == [('https://google.com/a', 0), ('https://google.com/b', 0)]